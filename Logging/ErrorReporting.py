@@ -1,6 +1,6 @@
 import traceback
 import datetime
-from config.gmailConfig import GmailClient
+from config.gmailConfig import gmailClient
 import logging
 from config.jsonFiles import AdminEmails
 
@@ -10,7 +10,7 @@ class ErrorNotify(logging.Handler):
     def __init__(self, adminEmail = adminList, level=logging.ERROR):
         super().__init__(level)
         self._adminEmail = adminEmail
-        self._mailer = GmailClient()
+        self._mailer = gmailClient ##Only authenticates if an error is actually reported
 
     def emit(self, record):
         try:
@@ -0,0 +1,105 @@
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.http import build_http
+import logging
+import os
+import tempfile
+import threading
+
+class PooledHttp:
+    """
+    httplib2.Http stand in that sends every request on the calling thread's keep-alive connections.
+    httplib2 is not thread safe, so each thread gets its own pool which every Google service shares
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def _http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = build_http() ##Also stops httplib2 treating the resumable upload 308 as a redirect
+            self._local.http = http
+        return http
+
+    def request(self, *args, **kwargs):
+        return self._http().request(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._http(), attr)
+
+class SharedAuthorizedHttp(AuthorizedHttp):
+    """AuthorizedHttp that refreshes its token through the credential manager before each request"""
+    def __init__(self, manager, tokenPath, credentials, http):
+        super().__init__(credentials, http=http)
+        self._manager = manager
+        self._tokenPath = tokenPath
+
+    def request(self, *args, **kwargs):
+        self._manager.refresh(self._tokenPath)
+        return super().request(*args, **kwargs)
+
+class CredentialManager:
+    """Loads, refreshes and saves the OAuth tokens of every Google service and hands out pooled transports"""
+    def __init__(self):
+        self._credentials = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._pool = PooledHttp()
+
+    def _lockFor(self, tokenPath):
+        with self._lock:
+            return self._locks.setdefault(tokenPath, threading.Lock())
+
+    def credentials(self, tokenPath, credPath, scopes):
+        """Returns valid credentials for a token file, refreshing or reauthorising if needed"""
+        with self._lockFor(tokenPath):
+            creds = self._credentials.get(tokenPath)
+            # Load existing token if available
+            if creds is None and os.path.exists(tokenPath):
+                creds = Credentials.from_authorized_user_file(tokenPath, scopes)
+
+            # If no creds or invalid, refresh or reauthorize
+            if not creds or not creds.valid:
+                if creds and creds.expired and creds.refresh_token:
+                    creds.refresh(Request())
+                    logging.info(f"Token {tokenPath} refreshed successfully.")
+                else:
+                    if not os.path.exists(credPath):
+                        raise FileNotFoundError(f"Missing credentials file: {credPath}")
+                    logging.warning(f"No valid credentials in {tokenPath}, starting manual authorization...")
+                    flow = InstalledAppFlow.from_client_secrets_file(credPath, scopes)
+                    creds = flow.run_local_server(port=0, access_type="offline", prompt="consent")
+                    logging.info("Authorization complete, saving new token.")
+                self._save(tokenPath, creds)
+            self._credentials[tokenPath] = creds
+            return creds
+
+    def refresh(self, tokenPath):
+        """Refreshes an expired token once, even when several threads notice at the same time"""
+        with self._lockFor(tokenPath):
+            creds = self._credentials[tokenPath]
+            if not creds.valid and creds.refresh_token:
+                creds.refresh(Request())
+                self._save(tokenPath, creds)
+                logging.info(f"Token {tokenPath} refreshed successfully.")
+
+    def _save(self, tokenPath, creds):
+        ##Written to a temporary file first so a crash never leaves a half written token
+        directory = os.path.dirname(tokenPath) or "."
+        fd, tmpPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as token:
+                token.write(creds.to_json())
+            os.replace(tmpPath, tokenPath)
+        except Exception:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+    def http(self, tokenPath):
+        """Authorised transport for a token on the shared keep-alive connection pool"""
+        return SharedAuthorizedHttp(self, tokenPath, self._credentials[tokenPath], self._pool)
+
+credentialManager = CredentialManager()
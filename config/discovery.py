@@ -0,0 +1,40 @@
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+import json
+import logging
+import os
+import threading
+
+##Discovery documents are pinned in the repo so every run builds clients from the same local copy
+DISCOVERY_DIR = "config/discovery"
+
+_documents = {}
+_lock = threading.Lock()
+
+def loadDocument(api, version):
+    """Returns the parsed discovery document for an api, pinning the library's bundled copy if it is not stored yet"""
+    key = (api, version)
+    if key not in _documents:
+        path = os.path.join(DISCOVERY_DIR, f"{api}.{version}.json")
+        if not os.path.exists(path):
+            content = get_static_doc(api, version)
+            if content is None:
+                raise FileNotFoundError(f"No discovery document available for {api} {version}")
+            os.makedirs(DISCOVERY_DIR, exist_ok=True)
+            with open(path, "w") as fh:
+                fh.write(content)
+            logging.info(f"Pinned discovery document {path}")
+        with open(path, "r") as fh:
+            _documents[key] = json.load(fh)
+    return _documents[key]
+
+def buildService(api, version, credentials=None, http=None):
+    """
+    Builds a googleapiclient service from the pinned discovery document.
+    The parsed document is shared, each call builds its own service on the credentials or http it was given
+    """
+    with _lock:
+        document = loadDocument(api, version)
+    service = build_from_document(document, credentials=credentials, http=http)
+    logging.info(f"Built {api} {version} client from the pinned discovery document")
+    return service
@@ -1,15 +1,22 @@
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from config.discovery import buildService
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import os
 import io
 import time
-import random
 import logging
+import threading
 from config.jsonFiles import DriveFiles
+from config.driveIndex import DriveIndex, FILE_FIELDS, FOLDER_MIME
+from config.mediaCache import MediaCache
+from config.uploadSessions import uploadSessions, UPLOAD_CHUNK_SIZE
+from config.registry import registry
+from config.credentialManager import credentialManager
+from config.rateLimiter import limiter
+from config.retryPolicy import policy, isRetryable
 
 # ----------------------------------
 # Logging setup
@@ -26,27 +33,19 @@ SCOPES = ["https://www.googleapis.com/auth/drive"]
 ROOT_FOLDER = DriveFiles["ROOT"]
 LOCAL_DOWNLOAD_DIR = "localStorage/downloads"
 
+##Parallel download settings, overridable from the environment
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_DOWNLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+DOWNLOAD_WORKERS = int(os.getenv("DRIVE_DOWNLOAD_WORKERS", 4))
+
 #--------------------------------------------------
 ###RETRY HELPER
 #--------------------------------------------------
-def retry(func, *args, retries=5, **kwargs):
-    """Retries Google API calls with an exponential backoff"""
-    delay = 1
-    for attempt in range(1, retries + 1):
-        try:
-            return func(*args, **kwargs)
-        except HttpError as e:
-            logging.error(f"HttpError on attempt {attempt}: {e}")
-            if attempt == retries:
-                logging.error("Max Retries Reached, was unable to access drive")
-                raise
-            sleepTime = delay + random.uniform(0, 0.5)
-            logging.warning(f"Retrying in {sleepTime:.2f}s...")
-            time.sleep(sleepTime)
-            delay *= 2
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-            raise
+def retry(func, *args, retries=5, cost=1, **kwargs):
+    """Retries Google API calls through the Drive retry policy, each attempt waits for `cost` queries of the shared Drive budget"""
+    def _attempt():
+        limiter("drive").acquire(cost)
+        return func(*args, **kwargs)
+    return policy("drive").call(_attempt, retries=retries)
 #------------------------------------------
 #AUTHENTICATION
 #------------------------------------------
@@ -55,42 +54,26 @@ class GoogleDrive:
 
         tokenPath = "config/credentials/token.json"
         credPath = "config/credentials/credentialsDrive.json"
-        creds = None
         try:
-            # Load existing token if available
-            if os.path.exists(tokenPath):
-                creds = Credentials.from_authorized_user_file(tokenPath, SCOPES)
-
-            # If no creds or invalid, refresh or reauthorize
-            if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
-                    logging.info("Token refreshed successfully.")
-                else:
-                    logging.warning("No valid credentials found, starting manual authorization...")
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        credPath, SCOPES
-                    )
-                    creds = flow.run_local_server(port=0, access_type="offline", prompt="consent")
-                    logging.info("Authorization complete, saving new token.")
-
-                # Save (new or refreshed) credentials
-                with open(tokenPath, "w") as token:
-                    token.write(creds.to_json())
-
+            credentialManager.credentials(tokenPath, credPath, SCOPES)
         except Exception as e:
             logging.error(f"Authentication error: {e}")
             raise RuntimeError("Google Drive authentication failed. Please reauthorize.") from e
 
         os.makedirs(LOCAL_DOWNLOAD_DIR, exist_ok=True)
+        self._cache = MediaCache()
         try:
-            self._client = build("drive", "v3", credentials=creds)
+            ##Every thread, including the download workers, uses its own pooled keep-alive connection
+            self._client = buildService("drive", "v3", http=credentialManager.http(tokenPath))
         except HttpError as e:
             logging.error(f"Failed to build Google Drive Client (API Error): {e}")
             raise
         except Exception as e:
             logging.error(f"Unexpected error creating Drieve client: {e}")
             raise
+        ##Bring the local metadata index up to date before answering any listings
+        self._index = DriveIndex()
+        self.sync_index()
         self._folders = {}
         for file in self.list_files_in_folder(ROOT_FOLDER):
             self._folders[file["id"]] = file["name"]
@@ -101,24 +84,189 @@ class GoogleDrive:
     # DRIVE HELPERS
     #-----------------------------------------
     def list_files_in_folder(self, folder_id):
-        def _list():
-            query = f"'{folder_id}' in parents"
-            results = self._client.files().list(q=query, fields="files(id, name)").execute()
-            return results.get("files", [])
-        return retry(_list)
-    
+        """Lists a folder, answered from the local index when the folder is inside the root tree"""
+        if folder_id == ROOT_FOLDER or self._index.contains(folder_id):
+            return self._index.children(folder_id)
+        return self._list_remote(folder_id)
+
+    def _list_remote(self, folder_id):
+        """Lists every (non trashed) file in a folder, following nextPageToken"""
+        files = []
+        pageToken = None
+        while True:
+            def _list():
+                query = f"'{folder_id}' in parents and trashed = false"
+                return self._client.files().list(
+                    q=query,
+                    fields=f"nextPageToken, files({FILE_FIELDS})",
+                    pageSize=1000,
+                    pageToken=pageToken
+                ).execute()
+            results = retry(_list)
+            files.extend(results.get("files", []))
+            pageToken = results.get("nextPageToken")
+            if not pageToken:
+                return files
+
+    #-----------------------------------------
+    # METADATA INDEX
+    #-----------------------------------------
+    def sync_index(self):
+        """Applies the changes feed since the saved page token, rebuilding the index if there is none"""
+        pageToken = self._index.getState("pageToken")
+        if pageToken is None or self._index.getState("root") != ROOT_FOLDER:
+            self.rebuild_index()
+            return
+        applied = 0
+        while pageToken:
+            def _changes():
+                return self._client.changes().list(
+                    pageToken=pageToken,
+                    fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+                    pageSize=1000,
+                    includeRemoved=True,
+                    spaces="drive"
+                ).execute()
+            try:
+                response = retry(_changes)
+            except HttpError as e:
+                ##An expired or invalid page token means the feed can't be trusted anymore
+                logging.warning(f"Changes feed unavailable ({e}), rebuilding the drive index")
+                self.rebuild_index()
+                return
+            for change in response.get("changes", []):
+                self._apply_change(change)
+                applied += 1
+            if "newStartPageToken" in response:
+                self._index.setState("pageToken", response["newStartPageToken"])
+                break
+            pageToken = response.get("nextPageToken")
+        logging.info(f"Drive index synced, {applied} changes applied")
+
+    def _apply_change(self, change):
+        fileId = change["fileId"]
+        file = change.get("file")
+        if change.get("removed") or file is None or file.get("trashed"):
+            self._index.remove(fileId)
+            return
+        parents = file.get("parents", [])
+        if not any(p == ROOT_FOLDER or self._index.contains(p) for p in parents):
+            ##The file is (no longer) part of the root tree
+            self._index.remove(fileId)
+            return
+        known = self._index.contains(fileId)
+        self._index.upsert([file])
+        if file.get("mimeType") == FOLDER_MIME and not known:
+            ##A folder moved into the tree brings its whole subtree with it
+            self._crawl(fileId)
+
+    def rebuild_index(self):
+        """Crawls the whole root tree and saves a fresh changes page token"""
+        startToken = retry(lambda: self._client.changes().getStartPageToken().execute())["startPageToken"]
+        self._index.clear()
+        count = self._crawl(ROOT_FOLDER)
+        self._index.setState("root", ROOT_FOLDER)
+        self._index.setState("pageToken", startToken)
+        logging.info(f"Drive index rebuilt with {count} files")
+
+    def _crawl(self, folder_id):
+        count = 0
+        pending = [folder_id]
+        while pending:
+            files = self._list_remote(pending.pop())
+            self._index.upsert(files)
+            count += len(files)
+            pending.extend(f["id"] for f in files if f.get("mimeType") == FOLDER_MIME)
+        return count
+
+    def get_metadata(self, file_id):
+        """Returns the indexed metadata for a file, fetching it from Drive if it is not indexed"""
+        file = self._index.get(file_id)
+        if file is None:
+            file = retry(lambda: self._client.files().get(fileId=file_id, fields=FILE_FIELDS).execute())
+        return file
+
     def getFolders(self):
         return self._folders
 
     def showRoot(self):
         print(self.list_files_in_folder(ROOT_FOLDER))
     
-    def download_file(self, file_id, filename):
+    def download_file(self, file_id, filename, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Downloads a file in byte ranges into a .part file with a sidecar state.
+        A retry (or a later run) continues from the last saved byte, and the result is checked against Drive's md5Checksum
+        """
+        localName = os.path.join(LOCAL_DOWNLOAD_DIR, filename)
+        partName = localName + ".part"
+        stateName = partName + ".json"
+        try:
+            meta = self.get_metadata(file_id)
+            if meta.get("size") is None: ##Native Google files have no size so can't be fetched by range
+                return self._download_stream(file_id, filename, chunk_size)
+            size = int(meta["size"])
+            md5 = meta.get("md5Checksum")
+
+            def _download():
+                offset = self._resume_offset(partName, stateName, file_id, md5)
+                with open(partName, "r+b" if offset else "wb") as fh:
+                    fh.seek(offset)
+                    fh.truncate()
+                    while offset < size:
+                        data = self._get_range(file_id, offset, min(offset + chunk_size, size) - 1)
+                        fh.write(data)
+                        fh.flush()
+                        offset += len(data)
+                        with open(stateName, "w") as state:
+                            json.dump({"fileId": file_id, "md5Checksum": md5, "size": size, "offset": offset}, state)
+                        logging.info(f"Download {int(offset * 100 / size) if size else 100}%.")
+                return partName
+
+            retry(_download)
+            if md5 and not self._verify_md5(partName, md5):
+                os.remove(partName)
+                os.remove(stateName)
+                raise ValueError(f"md5 mismatch for {filename}")
+            os.replace(partName, localName)
+            if os.path.exists(stateName):
+                os.remove(stateName)
+            logging.info(f"Downloaded {filename}")
+            print(f"Downloaded {filename}")
+            return localName
+        except Exception as e:
+            logging.error(f"Failed to download {filename}: {e}")
+            return None
+
+    def _resume_offset(self, partName, stateName, file_id, md5):
+        """Returns the byte to continue from if the kept partial file belongs to the same file version"""
+        try:
+            with open(stateName, "r") as state:
+                saved = json.load(state)
+        except (FileNotFoundError, ValueError):
+            return 0
+        if saved.get("fileId") != file_id or saved.get("md5Checksum") != md5 or not os.path.exists(partName):
+            return 0
+        offset = min(saved.get("offset", 0), os.path.getsize(partName))
+        if offset:
+            logging.info(f"Resuming download of {file_id} from byte {offset}")
+        return offset
+
+    def _verify_md5(self, path, md5):
+        digest = hashlib.md5()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b""):
+                digest.update(block)
+        if digest.hexdigest() != md5:
+            logging.error(f"Checksum mismatch for {path}: expected {md5}, got {digest.hexdigest()}")
+            return False
+        return True
+
+    def _download_stream(self, file_id, filename, chunk_size):
         localName = os.path.join(LOCAL_DOWNLOAD_DIR, filename)
         def _download():
             request = self._client.files().get_media(fileId=file_id)
             fh = io.FileIO(localName, "wb")
-            downloader = MediaIoBaseDownload(fh, request)
+            downloader = MediaIoBaseDownload(fh, request, chunksize=chunk_size)
             done = False
             while not done:
                 status, done = downloader.next_chunk()
@@ -126,36 +274,130 @@ class GoogleDrive:
                     logging.info(f"Download {int(status.progress()*100)}%.")
             fh.close()
             return localName
-        try:
-            path = retry(_download)
-            logging.info(f"Downloaded {filename}")
-            print(f"Downloaded {filename}")
-            return path
-        except Exception as e:
-            logging.error(f"Failed to download {filename}: {e}")
-            return None
-    
-    def upload_file(self, filename, folder_id, mime_type):
+        path = retry(_download)
+        logging.info(f"Downloaded {filename}")
+        print(f"Downloaded {filename}")
+        return path
+
+    def _get_range(self, file_id, start, end):
+        """Fetches bytes start to end (inclusive) of a file with a single Range request"""
+        request = self._client.files().get_media(fileId=file_id)
+        request.headers["Range"] = f"bytes={start}-{end}"
+        return request.execute()
+
+    def _fetch_range(self, file_id, start, end):
+        return retry(self._get_range, file_id, start, end)
+
+    def download_files(self, files, workers=DOWNLOAD_WORKERS, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Downloads several files at once on a bounded thread pool.
+        files is a list of (file_id, filename) pairs, every file is split into chunk_size byte ranges
+        so large files are fetched in parallel too. Returns the local paths in the same order (None on failure)
+        """
+        paths = [os.path.join(LOCAL_DOWNLOAD_DIR, filename) for _, filename in files]
+        sizes = []
+        checksums = []
+        parts = []
+        for index, (fileId, filename) in enumerate(files):
+            meta = self.get_metadata(fileId)
+            size = meta.get("size")
+            sizes.append(int(size) if size is not None else None)
+            checksums.append(meta.get("md5Checksum"))
+            if sizes[index] is None: ##Native Google files have no size and can't be range split
+                continue
+            with open(paths[index], "wb") as fh:
+                fh.truncate(sizes[index])
+            for start in range(0, sizes[index], chunk_size):
+                parts.append((index, start, min(start + chunk_size, sizes[index]) - 1))
+
+        totalBytes = sum(size for size in sizes if size)
+        progress = {"done": 0, "logged": -1}
+        progressLock = threading.Lock()
+        failed = set()
+
+        def _part(index, start, end):
+            if index in failed:
+                return
+            try:
+                data = self._fetch_range(files[index][0], start, end)
+                with open(paths[index], "r+b") as fh:
+                    fh.seek(start)
+                    fh.write(data)
+            except Exception as e:
+                logging.error(f"Failed to download bytes {start}-{end} of {files[index][1]}: {e}")
+                failed.add(index)
+                return
+            with progressLock:
+                progress["done"] += end - start + 1
+                percent = int(progress["done"] * 100 / totalBytes)
+                if percent // 10 > progress["logged"]:
+                    progress["logged"] = percent // 10
+                    logging.info(f"Download {percent}% of {len(files)} files.")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda part: _part(*part), parts))
+
+        for index, (fileId, filename) in enumerate(files):
+            if sizes[index] is None:
+                paths[index] = self.download_file(fileId, filename, chunk_size)
+            elif index in failed or (checksums[index] and not self._verify_md5(paths[index], checksums[index])):
+                os.remove(paths[index])
+                paths[index] = None
+            else:
+                logging.info(f"Downloaded {filename}")
+                print(f"Downloaded {filename}")
+        return paths
+
+    def cached_download_files(self, file_ids):
+        """
+        Returns read only local paths for Drive files, keyed by file id and md5Checksum in the media cache.
+        Only the files whose checksum is not cached yet are downloaded. Cached paths must not be deleted by callers
+        """
+        paths = [None] * len(file_ids)
+        misses = []
+        for index, fileId in enumerate(file_ids):
+            meta = self.get_metadata(fileId)
+            md5 = meta.get("md5Checksum")
+            if md5 is None: ##Native Google files have no checksum so can't be cached
+                paths[index] = self.download_file(fileId, meta["name"])
+                continue
+            key = f"{fileId}_{md5}{os.path.splitext(meta['name'])[1].lower()}"
+            paths[index] = self._cache.get(key)
+            if paths[index] is None:
+                misses.append((index, key))
+            else:
+                logging.info(f"Cache hit for {meta['name']}")
+
+        downloaded = self.download_files([(file_ids[index], f"{key}.part") for index, key in misses])
+        for (index, key), path in zip(misses, downloaded):
+            if path is not None:
+                paths[index] = self._cache.put(key, path)
+        return paths
+
+    def cached_download(self, file_id):
+        return self.cached_download_files([file_id])[0]
+
+    def upload_file(self, filename, folder_id, mime_type, chunk_size=UPLOAD_CHUNK_SIZE):
+        """Uploads in resumable chunks, a rerun for the same file continues the saved session"""
         file_metadata = {"name": os.path.basename(filename), "parents": [folder_id]}
-        media = MediaFileUpload(filename, mimetype=mime_type, resumable=True)
-        request = self._client.files().create(body=file_metadata, media_body=media, fields = "id")
+        media = MediaFileUpload(filename, mimetype=mime_type, chunksize=chunk_size, resumable=True)
+        request = self._client.files().create(body=file_metadata, media_body=media, fields = FILE_FIELDS)
         print(f"uploaded {filename} to folder {folder_id}")
 
-        response = None
-        while response is None:
-            try:
-                status, response = request.next_chunk()
-                if status:
-                    print(f"Uploaded {int(status.progress()*100)}%")
-                    logging.info(f"Uploaded {int(status.progress()*100)}%")
-            except HttpError as e:
-                logging.error(f"Upload error: {e}")
-                raise
+        try:
+            response = uploadSessions.upload(request, f"drive:{folder_id}", filename)
+        except HttpError as e:
+            logging.error(f"Upload error: {e}")
+            raise
         driveId = response.get("id")
+        self._apply_change({"fileId": driveId, "file": response})
         print(driveId)
         logging.info(f"Upload complete {filename} to {driveId}")
         return driveId
 
+    def has_pending_upload(self, filename, folder_id):
+        return uploadSessions.pending(f"drive:{folder_id}", filename)
+
     def makePublicLink(self, fileId):
         ##Make the file publicly accessible
         try:
@@ -175,15 +417,16 @@ class GoogleDrive:
     def move_file(self, file_id, target_folder_id):
         # Get the current parents to remove
         try:
-            file = self._client.files().get(fileId=file_id, fields="parents").execute()
+            file = self.get_metadata(file_id) ##Parents come from the index, saving a files.get round trip
             previous_parents = ",".join(file.get("parents", []))
             # Move the file
             file = self._client.files().update(
                 fileId=file_id,
                 addParents=target_folder_id,
                 removeParents=previous_parents,
-                fields="id, parents"
+                fields=FILE_FIELDS
             ).execute()
+            self._apply_change({"fileId": file_id, "file": file})
             print(f"Moved file {file_id} to folder {target_folder_id}")
             logging.info(f"Moved file {file_id} to folder {target_folder_id}")
         except Exception as e:
@@ -197,6 +440,7 @@ class GoogleDrive:
         
         try:
             retry(_delete)
+            self._index.remove(fileId)
             logging.info(f"Delete file with ID {fileId}")
             print(f"Delete file with ID {fileId}")
             return True
@@ -206,8 +450,111 @@ class GoogleDrive:
         except Exception as e:
             logging.error(f"Unexpected error while deleting file {fileId}: {e}")
             return False
-#Create Instance
-driveClient = GoogleDrive()
+
+    def batch(self):
+        """Returns a DriveBatch for queueing moves, deletes and public link grants"""
+        return DriveBatch(self)
+
+#--------------------------------------------------
+###BATCHED MUTATIONS
+#--------------------------------------------------
+BATCH_LIMIT = 100 ##Maximum number of calls the Drive batch endpoint accepts at once
+
+class DriveBatch:
+    """
+    Queues Drive mutations and sends them through the HTTP batch endpoint in groups of up to 100.
+    flush() returns one result per queued item in order: the moved file, True for a delete,
+    the public link for a permission grant, or None/False if that item failed
+    """
+    def __init__(self, drive):
+        self._drive = drive
+        self._queue = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        ##Flushed even after an error, the work already done by the caller expects these calls
+        self.flush()
+
+    def move(self, fileId, targetFolderId):
+        self._queue.append(("move", fileId, targetFolderId))
+
+    def delete(self, fileId):
+        self._queue.append(("delete", fileId, None))
+
+    def makePublic(self, fileId):
+        self._queue.append(("public", fileId, None))
+
+    def _request(self, kind, fileId, target):
+        client = self._drive._client
+        if kind == "move":
+            parents = self._drive.get_metadata(fileId).get("parents", [])
+            return client.files().update(
+                fileId=fileId,
+                addParents=target,
+                removeParents=",".join(parents),
+                fields=FILE_FIELDS
+            )
+        if kind == "delete":
+            return client.files().delete(fileId=fileId)
+        return client.permissions().create(fileId=fileId, body={"role":"reader", "type":"anyone"})
+
+    def flush(self, retries=5):
+        operations = self._queue
+        self._queue = []
+        results = [None] * len(operations)
+        pending = list(range(len(operations)))
+        for attempt in range(1, retries + 1):
+            failed = []
+            def _callback(requestId, response, exception):
+                index = int(requestId)
+                kind, fileId, target = operations[index]
+                if exception is not None:
+                    if isRetryable(exception):
+                        failed.append(index)
+                    else:
+                        logging.error(f"Batched {kind} failed for {fileId}: {exception}")
+                    return
+                if kind == "move":
+                    self._drive._apply_change({"fileId": fileId, "file": response})
+                    logging.info(f"Moved file {fileId} to folder {target}")
+                    results[index] = response
+                elif kind == "delete":
+                    self._drive._index.remove(fileId)
+                    logging.info(f"Delete file with ID {fileId}")
+                    results[index] = True
+                else:
+                    results[index] = f"https://drive.google.com/file/d/{fileId}/view?usp=sharing"
+                    logging.info(f"Publink created for file {fileId}: {results[index]}")
+
+            for start in range(0, len(pending), BATCH_LIMIT):
+                batch = self._drive._client.new_batch_http_request(callback=_callback)
+                for index in pending[start:start + BATCH_LIMIT]:
+                    try:
+                        batch.add(self._request(*operations[index]), request_id=str(index))
+                    except Exception as e:
+                        logging.error(f"Could not queue {operations[index][0]} for {operations[index][1]}: {e}")
+                retry(batch.execute, cost=len(pending[start:start + BATCH_LIMIT])) ##Every sub request counts against the quota
+
+            if not failed:
+                break
+            ##Only the sub requests that failed are sent again
+            pending = sorted(failed)
+            if attempt == retries:
+                logging.error(f"{len(pending)} batched drive calls still failing after {retries} attempts")
+                break
+            sleepTime = policy("drive").backoff(attempt)
+            logging.warning(f"{len(pending)} batched drive calls failed, retrying in {sleepTime:.2f}s...")
+            time.sleep(sleepTime)
+
+        for index, (kind, _, _) in enumerate(operations):
+            if kind == "delete" and results[index] is None:
+                results[index] = False
+        return results
+
+#Create Instance, authentication and the index sync wait until the client is first used
+driveClient = registry.register("drive", GoogleDrive)
 
 
 
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+import os
+
+INDEX_PATH = "localStorage/driveIndex.db"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+##Fields requested from Drive for every file that goes into the index
+FILE_FIELDS = "id, name, parents, size, md5Checksum, mimeType, modifiedTime, trashed"
+
+class DriveIndex:
+    """Local SQLite copy of the Drive metadata for the folder tree under the root folder"""
+    def __init__(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    size INTEGER,
+                    md5Checksum TEXT,
+                    mimeType TEXT,
+                    modifiedTime TEXT
+                );
+                CREATE TABLE IF NOT EXISTS parents (
+                    fileId TEXT,
+                    parentId TEXT,
+                    PRIMARY KEY (fileId, parentId)
+                );
+                CREATE INDEX IF NOT EXISTS parentsByParent ON parents (parentId);
+                CREATE TABLE IF NOT EXISTS state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+
+    #-----------------------------------------
+    # SYNC STATE
+    #-----------------------------------------
+    def getState(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def setState(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    def clear(self):
+        """Drop every indexed file, used before a full rebuild"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM parents")
+            self._conn.execute("DELETE FROM state")
+
+    #-----------------------------------------
+    # FILE RECORDS
+    #-----------------------------------------
+    def upsert(self, files):
+        """Insert or update the metadata for a list of Drive file resources"""
+        with self._lock, self._conn:
+            for file in files:
+                size = file.get("size")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (id, name, size, md5Checksum, mimeType, modifiedTime) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        file["id"],
+                        file.get("name"),
+                        int(size) if size is not None else None,
+                        file.get("md5Checksum"),
+                        file.get("mimeType"),
+                        file.get("modifiedTime"),
+                    )
+                )
+                self._conn.execute("DELETE FROM parents WHERE fileId = ?", (file["id"],))
+                self._conn.executemany(
+                    "INSERT INTO parents (fileId, parentId) VALUES (?, ?)",
+                    [(file["id"], parent) for parent in file.get("parents", [])]
+                )
+
+    def remove(self, fileId):
+        """Remove a file and, if it is a folder, everything indexed underneath it"""
+        with self._lock, self._conn:
+            pending = [fileId]
+            while pending:
+                current = pending.pop()
+                children = self._conn.execute("SELECT fileId FROM parents WHERE parentId = ?", (current,)).fetchall()
+                pending.extend(row["fileId"] for row in children)
+                self._conn.execute("DELETE FROM files WHERE id = ?", (current,))
+                self._conn.execute("DELETE FROM parents WHERE fileId = ?", (current,))
+
+    def contains(self, fileId):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM files WHERE id = ?", (fileId,)).fetchone()
+        return row is not None
+
+    def get(self, fileId):
+        """Return the indexed metadata of a single file, or None if it is not indexed"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE id = ?", (fileId,)).fetchone()
+            if row is None:
+                return None
+            return self._toDict(row)
+
+    def children(self, folderId):
+        """Return every indexed file that has folderId as a parent"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT files.* FROM files JOIN parents ON parents.fileId = files.id WHERE parents.parentId = ? ORDER BY files.name",
+                (folderId,)
+            ).fetchall()
+            return [self._toDict(row) for row in rows]
+
+    def _toDict(self, row):
+        ##Must be called with the lock held
+        file = dict(row)
+        parents = self._conn.execute("SELECT parentId FROM parents WHERE fileId = ?", (file["id"],)).fetchall()
+        file["parents"] = [parent["parentId"] for parent in parents]
+        return file
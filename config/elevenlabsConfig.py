@@ -1,5 +1,7 @@
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import ElevenLabs, AsyncElevenLabs
 import logging
+from config.registry import registry
+from config.rateLimiter import ConcurrencySlots, ELEVENLABS_CONCURRENCY
 from dotenv import load_dotenv
 import os
 
@@ -10,9 +12,26 @@ logging.basicConfig(
     filemode="a",                       # "w" to overwrite, "a" to append
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
-try:
-    elClient = ElevenLabs(api_key=os.getenv("ELEVENLABS_KEY"))
-    logging.info("Successful Elevenlabs implementation")
-except Exception as e:
-    logging.error(f"Unable to establish Elevenlabs client: {e}")
-    elClient = None
+def _buildElevenlabs():
+    try:
+        client = ElevenLabs(api_key=os.getenv("ELEVENLABS_KEY"))
+        logging.info("Successful Elevenlabs implementation")
+        return client
+    except Exception as e:
+        logging.error(f"Unable to establish Elevenlabs client: {e}")
+        return None
+
+def _buildAsyncElevenlabs():
+    try:
+        client = AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_KEY"))
+        logging.info("Successful async Elevenlabs implementation")
+        return client
+    except Exception as e:
+        logging.error(f"Unable to establish async Elevenlabs client: {e}")
+        return None
+
+##Hold a slot for the whole request, the audio streams in while the generator is consumed
+ttsSlots = ConcurrencySlots("elevenlabs", ELEVENLABS_CONCURRENCY)
+
+elClient = registry.register("elevenlabs", _buildElevenlabs)
+asyncElClient = registry.register("elevenlabs-async", _buildAsyncElevenlabs)
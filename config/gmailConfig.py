@@ -1,15 +1,12 @@
 import base64
-import os.path
 from email.message import EmailMessage
-from typing import Optional
 import logging
-import time
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from config.discovery import buildService
 from googleapiclient.errors import HttpError
+from config.registry import registry
+from config.credentialManager import credentialManager
+from config.retryPolicy import policy
 
 
 # Gmail API scope for sending mail 
@@ -31,27 +28,10 @@ class GmailClient:
         self._credentialsFile = credentialsFile
         self._auth()
     def _auth(self):
-        creds: Optional[Credentials] = None
         try:
-            if os.path.exists(self._tokenFile):
-                creds = Credentials.from_authorized_user_file(self._tokenFile, SCOPES)
-            if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
-                else:
-                    if not os.path.exists(self._credentialsFile):
-                        raise FileNotFoundError(f"Missing credentials file: {self._credentialsFile}")
-                    flow = InstalledAppFlow.from_client_secrets_file(self._credentialsFile, SCOPES)
-                    creds = flow.run_local_server(
-                        port=0,
-                        access_type="offline",
-                        prompt="consent"
-                        )
-
-                with open(self._tokenFile, "w") as token:
-                    token.write(creds.to_json())
-            
-            self._client = build("gmail", "v1", credentials=creds)
+            credentialManager.credentials(self._tokenFile, self._credentialsFile, SCOPES)
+            ##Each GmailClient builds its own service on its token's transport, only the parsed discovery document is shared
+            self._client = buildService("gmail", "v1", http=credentialManager.http(self._tokenFile))
             logging.info("Gmail Client successfully established")
         except Exception as e:
             logging.error(f"Gmail authentication failed: {e}")
@@ -69,33 +49,29 @@ class GmailClient:
             logging.warning(f"{to} is not an email address, suggest removal - email not sent")
             return False
         
-        maxRetries = 5
-        for retry in range(1, maxRetries + 1):
-            backOff = 2**retry
-            try:
-                message = EmailMessage()
-                message["To"] = to
-                message["From"] = "me"
-                message["Subject"] = subject
+        try:
+            message = EmailMessage()
+            message["To"] = to
+            message["From"] = "me"
+            message["Subject"] = subject
 
-                if html:
-                    message.add_alternative(body, subtype="html")
-                else:
-                    message.set_content(body)
+            if html:
+                message.add_alternative(body, subtype="html")
+            else:
+                message.set_content(body)
 
-                encodedMessage = base64.urlsafe_b64encode(message.as_bytes()).decode()
-                createMessage = {"raw": encodedMessage}
+            encodedMessage = base64.urlsafe_b64encode(message.as_bytes()).decode()
+            createMessage = {"raw": encodedMessage}
 
-                sendResult = self._client.users().messages().send(userId="me", body=createMessage).execute()
-                logging.info(f"Email sent to {to}, Message ID: {sendResult.get('id')}")
-                return True ##Break the chain and return that the email is sent
-            
-            except HttpError as e:
-                logging.error(f"Gmail API error: {e} Retrying in {backOff} seconds")
-            except Exception as e:
-                logging.error(f"Failed to send email: {e}, Retrying in {backOff} seconds")
-            time.sleep(backOff)
-            
-        return False ##Only return False if the email fails all times
+            sendResult = policy("gmail").call(
+                lambda: self._client.users().messages().send(userId="me", body=createMessage).execute()
+            )
+            logging.info(f"Email sent to {to}, Message ID: {sendResult.get('id')}")
+            return True
+        except HttpError as e:
+            logging.error(f"Gmail API error: {e}")
+        except Exception as e:
+            logging.error(f"Failed to send email: {e}")
+        return False ##Only return False if the email could not be sent
     
-gmailClient = GmailClient()
+gmailClient = registry.register("gmail", GmailClient)
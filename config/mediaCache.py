@@ -0,0 +1,66 @@
+import os
+import stat
+import logging
+
+CACHE_DIR = "localStorage/cache"
+##Maximum number of bytes kept in the cache before the least recently used files are evicted
+CACHE_BUDGET = int(os.getenv("MEDIA_CACHE_BYTES", 5 * 1024 * 1024 * 1024))
+
+class MediaCache:
+    """Content addressed file cache with a byte budget and least recently used eviction"""
+    def __init__(self, root=CACHE_DIR, budget=CACHE_BUDGET):
+        self._root = root
+        self._budget = budget
+        os.makedirs(self._root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self._root, key)
+
+    def get(self, key):
+        """Returns the cached path for a key (and marks it as recently used), or None on a miss"""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(path) ##The modified time doubles as the last used time
+        except OSError as e:
+            logging.warning(f"Could not touch cached file {path}: {e}")
+        return path
+
+    def put(self, key, sourcePath):
+        """Moves a finished file into the cache as read only and returns its cached path"""
+        path = self.path(key)
+        if os.path.exists(path): ##Another run cached the same content first
+            os.remove(sourcePath)
+        else:
+            os.replace(sourcePath, path)
+            os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.utime(path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Removes the least recently used files until the cache fits inside its budget"""
+        entries = []
+        total = 0
+        for name in os.listdir(self._root):
+            path = os.path.join(self._root, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError: ##Evicted by another process
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self._budget:
+                break
+            if path == keep:
+                continue
+            try:
+                os.chmod(path, stat.S_IWUSR | stat.S_IRUSR)
+                os.remove(path)
+                total -= size
+                logging.info(f"Evicted {path} from the media cache")
+            except OSError as e:
+                logging.warning(f"Could not evict {path}: {e}")
@@ -1,7 +1,11 @@
-from openai import OpenAI, RateLimitError, APIError, APIConnectionError, Timeout
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient, RateLimitError, APIError, APIConnectionError, Timeout
 from dotenv import load_dotenv
+import asyncio
+import json
 import os
 import logging
+from config.registry import registry
+from config.rateLimiter import limiter
 
 load_dotenv()
 
@@ -12,15 +16,55 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+def estimateTokens(body):
+    """Rough token count of a request, about four characters a token plus the completion allowance"""
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return 1
+    prompt = sum(len(str(message.get("content", ""))) for message in payload.get("messages", []))
+    completion = payload.get("max_completion_tokens") or payload.get("max_tokens") or 1000
+    return prompt // 4 + completion
+
+def _waitForBudget(request):
+    ##Runs before every request the client sends, retries included
+    limiter("openai_requests").acquire()
+    limiter("openai_tokens").acquire(estimateTokens(request.content))
+
+async def _waitForBudgetAsync(request):
+    ##The limiter blocks, so it waits on a worker thread instead of the event loop
+    await asyncio.to_thread(_waitForBudget, request)
+
 ##Attempt to connect to the openai API
-try:
-    openaiClient = OpenAI(api_key=os.getenv("OPEN_AI_KEY"))
-    logging.info("Openai client successfully created")
-except EnvironmentError as e:
-    logging.error(f"AI Key is not present: {e}")
-    openaiClient = None
-except Exception as e:
-    logging.error(f"Unexpected exception: {e}")
-    openaiClient = None
+def _buildOpenai():
+    try:
+        client = OpenAI(
+            api_key=os.getenv("OPEN_AI_KEY"),
+            max_retries=0, ##Retries go through the shared openai retry policy
+            http_client=DefaultHttpxClient(event_hooks={"request": [_waitForBudget]})
+        )
+        logging.info("Openai client successfully created")
+        return client
+    except EnvironmentError as e:
+        logging.error(f"AI Key is not present: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected exception: {e}")
+    return None
+
+openaiClient = registry.register("openai", _buildOpenai)
 
+##Async client for the batch mode, sharing the same rate limits
+def _buildAsyncOpenai():
+    try:
+        client = AsyncOpenAI(
+            api_key=os.getenv("OPEN_AI_KEY"),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(event_hooks={"request": [_waitForBudgetAsync]})
+        )
+        logging.info("Async openai client successfully created")
+        return client
+    except Exception as e:
+        logging.error(f"Unexpected exception: {e}")
+    return None
 
+asyncOpenaiClient = registry.register("openai-async", _buildAsyncOpenai)
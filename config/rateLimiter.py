@@ -0,0 +1,121 @@
+from filelock import FileLock, Timeout
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+
+LIMIT_DIR = "localStorage/rateLimits"
+
+##Per service budgets as (calls, seconds), overridable from the environment
+LIMITS = {
+    "sheets_read": (int(os.getenv("SHEETS_READS_PER_MINUTE", 60)), 60),
+    "sheets_write": (int(os.getenv("SHEETS_WRITES_PER_MINUTE", 60)), 60),
+    "drive": (int(os.getenv("DRIVE_QUERIES_PER_100S", 1000)), 100),
+    "openai_requests": (int(os.getenv("OPENAI_RPM", 500)), 60),
+    "openai_tokens": (int(os.getenv("OPENAI_TPM", 200000)), 60),
+}
+##Number of ElevenLabs requests allowed to run at the same time
+ELEVENLABS_CONCURRENCY = int(os.getenv("ELEVENLABS_CONCURRENCY", 2))
+
+class TokenBucket:
+    """
+    Token bucket whose state lives in a locked file, so every thread and every script on the machine
+    draws from the same budget. Callers wait for tokens up front instead of hitting the quota
+    """
+    def __init__(self, name, capacity, period, root=LIMIT_DIR):
+        self._name = name
+        self._capacity = capacity
+        self._rate = capacity / period ##Tokens added back per second
+        os.makedirs(root, exist_ok=True)
+        self._path = os.path.join(root, f"{name}.json")
+        self._lock = FileLock(self._path + ".lock")
+
+    def _read(self, now):
+        try:
+            with open(self._path, "r") as fh:
+                state = json.load(fh)
+            return state["tokens"], state["updated"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return self._capacity, now ##A new bucket starts full
+
+    def _write(self, tokens, now):
+        tmpPath = self._path + ".tmp"
+        with open(tmpPath, "w") as fh:
+            json.dump({"tokens": tokens, "updated": now}, fh)
+        os.replace(tmpPath, self._path)
+
+    def acquire(self, tokens=1):
+        """Blocks until the tokens are available and takes them, returns the seconds spent waiting"""
+        tokens = min(tokens, self._capacity) ##A request bigger than the bucket only waits for a full bucket
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.time()
+                available, updated = self._read(now)
+                available = min(self._capacity, available + max(0, now - updated) * self._rate)
+                if available >= tokens:
+                    self._write(available - tokens, now)
+                    if waited:
+                        logging.info(f"Waited {waited:.2f}s for the {self._name} rate limit")
+                    return waited
+                self._write(available, now)
+            wait = (tokens - available) / self._rate
+            time.sleep(wait)
+            waited += wait
+
+class ConcurrencySlots:
+    """Limits how many calls run at once across threads and processes, one lock file per slot"""
+    def __init__(self, name, slots, root=LIMIT_DIR, poll=0.2):
+        os.makedirs(root, exist_ok=True)
+        self._name = name
+        self._locks = [FileLock(os.path.join(root, f"{name}.{slot}.lock"), thread_local=False) for slot in range(slots)]
+        self._guard = threading.Lock() ##The file locks are reentrant, so threads must not race for the same one
+        self._poll = poll
+
+    def _tryAcquire(self):
+        with self._guard:
+            for lock in self._locks:
+                if lock.is_locked: ##Already held by another thread of this process
+                    continue
+                try:
+                    lock.acquire(blocking=False)
+                    return lock
+                except Timeout: ##Held by another process
+                    continue
+        return None
+
+    def acquire(self):
+        """Takes a free slot, waiting for one if they are all busy, and returns it for release()"""
+        start = time.time()
+        lock = self._tryAcquire()
+        while lock is None:
+            time.sleep(self._poll)
+            lock = self._tryAcquire()
+        waited = time.time() - start
+        if waited >= self._poll:
+            logging.info(f"Waited {waited:.2f}s for a {self._name} slot")
+        return lock
+
+    def release(self, lock):
+        with self._guard:
+            lock.release()
+
+    @contextmanager
+    def slot(self):
+        """Holds a free slot for the duration of the with block"""
+        lock = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(lock)
+
+_buckets = {}
+
+def limiter(name):
+    """The shared bucket for a service in LIMITS"""
+    if name not in _buckets:
+        capacity, period = LIMITS[name]
+        _buckets[name] = TokenBucket(name, capacity, period)
+    return _buckets[name]
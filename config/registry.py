@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+import time
+
+##Seconds the service clients of one run may take to build before a warning is logged
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET_SECONDS", 5))
+
+class ServiceRegistry:
+    """Builds service clients and worksheets on first use and measures what each one costs"""
+    def __init__(self, budget=STARTUP_BUDGET):
+        self._factories = {}
+        self._instances = {}
+        self._timings = {}
+        self._building = set()
+        self._budget = budget
+        self._lock = threading.RLock()
+
+    def register(self, name, factory, *args, **kwargs):
+        """Registers a factory and returns a stand in that builds the service the first time it is used"""
+        self._factories[name] = (factory, args, kwargs)
+        return LazyService(self, name)
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._instances:
+                if name in self._building: ##e.g. the error mailer reporting a failure while it is being built
+                    raise RuntimeError(f"{name} was used while it was still being built")
+                factory, args, kwargs = self._factories[name]
+                self._building.add(name)
+                start = time.perf_counter()
+                try:
+                    self._instances[name] = factory(*args, **kwargs)
+                finally:
+                    self._building.discard(name)
+                self._timings[name] = time.perf_counter() - start
+                total = sum(self._timings.values())
+                logging.info(f"Built {name} in {self._timings[name]:.2f}s ({total:.2f}s of startup so far)")
+                if total > self._budget:
+                    logging.warning(f"Service startup took {total:.2f}s, over the {self._budget:.2f}s budget: {self.timings()}")
+            return self._instances[name]
+
+    def built(self, name):
+        return name in self._instances
+
+    def timings(self):
+        return {name: round(seconds, 3) for name, seconds in self._timings.items()}
+
+class LazyService:
+    """Stands in for a registered service, everything is forwarded to the real object once it is built"""
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry, name):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def _resolve(self):
+        return self._registry.get(self._name)
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._resolve(), attr, value)
+
+    def __bool__(self):
+        ##Factories return None when a service could not be set up
+        return self._resolve() is not None
+
+    def __repr__(self):
+        if self._registry.built(self._name):
+            return repr(self._resolve())
+        return f"<lazy {self._name}>"
+
+registry = ServiceRegistry()
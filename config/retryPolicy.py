@@ -0,0 +1,182 @@
+from googleapiclient.errors import HttpError
+from email.utils import parsedate_to_datetime
+import asyncio
+import datetime
+import httplib2
+import httpx
+import logging
+import openai
+import random
+import requests
+import threading
+import time
+
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+##Network failures from each client library, always worth another attempt
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    httplib2.HttpLib2Error,
+    httpx.TransportError,
+    openai.APIConnectionError, ##Also the base of APITimeoutError, neither has a status code
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the service while its circuit is open"""
+
+def statusCode(error):
+    """HTTP status of an error from googleapiclient, gspread, openai or elevenlabs, None if there was no response"""
+    if isinstance(error, HttpError):
+        return int(error.resp.status)
+    status = getattr(error, "status_code", None) ##openai and elevenlabs
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None) ##gspread
+    return status
+
+def _headers(error):
+    if isinstance(error, HttpError):
+        return error.resp ##httplib2 keeps the headers with lower case names
+    headers = getattr(error, "headers", None) ##elevenlabs
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) ##openai and gspread
+    return headers or {}
+
+def retryAfter(error):
+    """Seconds the service asked us to wait through Retry-After (or retry-after-ms), None if it did not say"""
+    headers = _headers(error)
+    try:
+        milliseconds = headers.get("retry-after-ms")
+        if milliseconds is not None:
+            return float(milliseconds) / 1000
+        value = headers.get("retry-after") or headers.get("Retry-After")
+    except AttributeError:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        ##The header can also be an HTTP date
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def isRetryable(error):
+    """True for network failures, throttling and server errors, False for errors another attempt cannot fix"""
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    status = statusCode(error)
+    if status in RETRYABLE_STATUS:
+        return True
+    ##Google reports per user quota errors as 403 rateLimitExceeded / userRateLimitExceeded
+    details = str(error) + str(getattr(error, "content", "")) ##The reason is in the body of an HttpError
+    return status == 403 and "ratelimitexceeded" in details.lower()
+
+class RetryPolicy:
+    """
+    Retries calls to one service with full jitter backoff, honouring Retry-After, within a deadline.
+    Consecutive failures trip a circuit breaker so later calls fail fast until the cooldown has passed
+    """
+    def __init__(self, name, retries=5, base=1, cap=60, deadline=300, threshold=5, cooldown=300):
+        self.name = name
+        self._retries = retries
+        self._base = base
+        self._cap = cap
+        self._deadline = deadline
+        self._threshold = threshold ##Consecutive failed attempts before the circuit opens
+        self._cooldown = cooldown
+        self._failures = 0
+        self._openUntil = 0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, error=None):
+        """Seconds to wait before the next attempt, the service's Retry-After wins over the jittered backoff"""
+        requested = retryAfter(error) if error is not None else None
+        if requested is not None:
+            return requested
+        return random.uniform(0, min(self._cap, self._base * 2 ** attempt))
+
+    def _checkCircuit(self):
+        with self._lock:
+            remaining = self._openUntil - time.time()
+        if remaining > 0:
+            raise CircuitOpenError(f"{self.name} circuit is open for another {remaining:.0f}s after repeated failures")
+
+    def _recordSuccess(self):
+        with self._lock:
+            self._failures = 0
+
+    def _recordFailure(self):
+        with self._lock:
+            self._failures += 1
+            ##Once open, a single failure after the cooldown opens it again
+            if self._failures >= self._threshold:
+                self._openUntil = time.time() + self._cooldown
+                logging.error(f"{self.name} circuit opened for {self._cooldown}s after {self._failures} failures")
+
+    def _afterFailure(self, error, attempt, retries, stopAt):
+        """Seconds to wait before the next attempt, or None if the error should be raised"""
+        if not isRetryable(error):
+            return None
+        self._recordFailure()
+        if attempt == retries:
+            logging.error(f"{self.name}: giving up after {retries} attempts: {error}")
+            return None
+        sleepTime = self.backoff(attempt, error)
+        if time.time() + sleepTime > stopAt:
+            logging.error(f"{self.name}: giving up, waiting {sleepTime:.2f}s would pass the {self._deadline}s deadline: {error}")
+            return None
+        logging.warning(f"{self.name} attempt {attempt} failed: {error}. Retrying in {sleepTime:.2f}s...")
+        return sleepTime
+
+    def call(self, func, *args, retries=None, **kwargs):
+        """Calls func until it succeeds, raising the last error once the attempts, deadline or circuit run out"""
+        retries = retries or self._retries
+        stopAt = time.time() + self._deadline
+        for attempt in range(1, retries + 1):
+            self._checkCircuit()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                sleepTime = self._afterFailure(e, attempt, retries, stopAt)
+                if sleepTime is None:
+                    raise
+                time.sleep(sleepTime)
+                continue
+            self._recordSuccess()
+            return result
+
+    async def acall(self, func, *args, retries=None, **kwargs):
+        """call() for coroutine functions, the backoff sleeps without blocking the event loop"""
+        retries = retries or self._retries
+        stopAt = time.time() + self._deadline
+        for attempt in range(1, retries + 1):
+            self._checkCircuit()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                sleepTime = self._afterFailure(e, attempt, retries, stopAt)
+                if sleepTime is None:
+                    raise
+                await asyncio.sleep(sleepTime)
+                continue
+            self._recordSuccess()
+            return result
+
+##One policy per service so the circuit is shared by every caller in the process
+POLICIES = {
+    "drive": RetryPolicy("drive", deadline=300),
+    "sheets": RetryPolicy("sheets", deadline=120),
+    "gmail": RetryPolicy("gmail", deadline=60, cap=16),
+    "youtube": RetryPolicy("youtube", deadline=600),
+    "openai": RetryPolicy("openai", deadline=180),
+    "elevenlabs": RetryPolicy("elevenlabs", deadline=300),
+}
+
+def policy(name):
+    return POLICIES[name]
@@ -0,0 +1,83 @@
+from gspread.utils import rowcol_to_a1, ValueInputOption
+import logging
+from config.sheetSnapshot import invalidate
+
+def rowRanges(rows):
+    """Merges row numbers into (first, last) ranges of adjacent rows, bottom range first"""
+    ranges = []
+    for row in sorted(set(rows), reverse=True):
+        if ranges and ranges[-1][0] == row + 1:
+            ranges[-1] = (row, ranges[-1][1])
+        else:
+            ranges.append((row, row))
+    return ranges
+
+def deleteRows(worksheet, rows):
+    """
+    Deletes a set of row numbers in a single batchUpdate.
+    Adjacent rows are merged into one deleteDimension and the ranges run bottom up so earlier row numbers stay valid
+    """
+    ranges = rowRanges(rows)
+    if not ranges:
+        return
+    requests = [{
+        "deleteDimension": {
+            "range": {"sheetId": worksheet.id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last}
+        }
+    } for first, last in ranges]
+    worksheet.spreadsheet.batch_update({"requests": requests})
+    invalidate(worksheet)
+    logging.info(f"Deleted {len(set(rows))} rows in {len(ranges)} ranges from {worksheet.title} in one request")
+
+class WriteSession:
+    """
+    Buffers cell updates, row appends and row deletions for one worksheet and sends them together on commit.
+    Row numbers always refer to the sheet as it was when the session started
+    """
+    def __init__(self, worksheet, table=None):
+        self._worksheet = worksheet
+        self._table = table ##A KeyedTable over the same worksheet that is kept in step with the writes
+        self._updates = {}
+        self._appends = []
+        self._deletes = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        ##Committed even after an error so the writes for the work already done are not lost
+        self.commit()
+
+    def update_cell(self, row, col, value):
+        self._updates[(row, col)] = value ##A later write to the same cell replaces the earlier one
+
+    def append_row(self, values):
+        self._appends.append(list(values))
+
+    def delete_rows(self, start_index, end_index=None):
+        self._deletes.update(range(start_index, (end_index or start_index) + 1))
+
+    def commit(self):
+        """Sends the buffered writes: one values batch update, one delete batch and one append"""
+        title = self._worksheet.title
+        if self._updates or self._appends:
+            invalidate(self._worksheet)
+        if self._updates:
+            ##USER_ENTERED matches what update_cell did for each cell
+            self._worksheet.batch_update(
+                [{"range": rowcol_to_a1(row, col), "values": [[value]]} for (row, col), value in self._updates.items()],
+                value_input_option=ValueInputOption.user_entered
+            )
+            logging.info(f"Wrote {len(self._updates)} cells to {title} in one request")
+            self._updates = {}
+        if self._deletes:
+            deleteRows(self._worksheet, self._deletes)
+            if self._table is not None:
+                self._table.deleted(self._deletes)
+            self._deletes = set()
+        if self._appends:
+            self._worksheet.append_rows(self._appends)
+            logging.info(f"Appended {len(self._appends)} rows to {title} in one request")
+            if self._table is not None:
+                self._table.appended(self._appends)
+            self._appends = []
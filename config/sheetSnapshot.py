@@ -0,0 +1,50 @@
+from gspread.urls import DRIVE_FILES_API_V3_URL
+import json
+import logging
+import os
+
+SNAPSHOT_DIR = "localStorage/sheetSnapshots"
+
+def _snapshotPath(worksheet):
+    return os.path.join(SNAPSHOT_DIR, f"{worksheet.spreadsheet_id}_{worksheet.id}.json")
+
+def spreadsheetVersion(worksheet):
+    """Drive version and modifiedTime of the worksheet's spreadsheet, one small metadata request"""
+    response = worksheet.client.request(
+        "get",
+        f"{DRIVE_FILES_API_V3_URL}/{worksheet.spreadsheet_id}",
+        params={"fields": "version,modifiedTime", "supportsAllDrives": True}
+    ).json()
+    return f"{response.get('version')}@{response.get('modifiedTime')}"
+
+def getRecords(worksheet):
+    """
+    get_all_records read through a local snapshot.
+    The full values are only downloaded again when the spreadsheet's Drive version has changed
+    """
+    path = _snapshotPath(worksheet)
+    version = spreadsheetVersion(worksheet) ##Taken before the read so a concurrent edit just causes a refetch next time
+    try:
+        with open(path, "r") as fh:
+            snapshot = json.load(fh)
+        if snapshot["version"] == version:
+            logging.info(f"Using the snapshot of {worksheet.title} at version {version}")
+            return snapshot["records"]
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    records = worksheet.get_all_records()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as fh:
+        json.dump({"version": version, "records": records}, fh)
+    os.replace(tmpPath, path)
+    logging.info(f"Saved a snapshot of {worksheet.title} at version {version}")
+    return records
+
+def invalidate(worksheet):
+    """Drops the snapshot of a worksheet after writing to it"""
+    try:
+        os.remove(_snapshotPath(worksheet))
+    except FileNotFoundError:
+        pass
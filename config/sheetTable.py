@@ -0,0 +1,66 @@
+from gspread.utils import rowcol_to_a1
+import bisect
+import logging
+
+class KeyedTable:
+    """
+    Reads a worksheet's key column (plus any other columns the caller needs) in one request
+    and answers id lookups locally from an id to row number map
+    """
+    def __init__(self, worksheet, keyColumn, columns=(), headerRows=1):
+        self._worksheet = worksheet
+        self._keyColumn = keyColumn
+        self._columns = sorted(set(columns) | {keyColumn})
+        self._firstRow = headerRows + 1
+        ##One open ended range per column, e.g. E2:E
+        ranges = []
+        for col in self._columns:
+            letter = rowcol_to_a1(1, col)[:-1]
+            ranges.append(f"{letter}{self._firstRow}:{letter}")
+        columnValues = worksheet.batch_get(ranges)
+        self._rowValues = {} ##row number -> {column: value}
+        for col, values in zip(self._columns, columnValues):
+            for offset, cell in enumerate(values):
+                if cell:
+                    self._rowValues.setdefault(self._firstRow + offset, {})[col] = cell[0]
+        self._lastRow = max(self._rowValues, default=self._firstRow - 1)
+        self._rebuildKeys()
+        logging.info(f"Loaded {len(self._rows)} keys from {worksheet.title}")
+
+    def _rebuildKeys(self):
+        self._rows = {}
+        for row in sorted(self._rowValues):
+            key = self._rowValues[row].get(self._keyColumn)
+            if key not in (None, "") and key not in self._rows: ##Like find, the first match wins
+                self._rows[key] = row
+
+    def row(self, key):
+        """Row number of the key, or None if it is not in the sheet"""
+        return self._rows.get(str(key))
+
+    def value(self, key, column, default=""):
+        row = self.row(key)
+        if row is None:
+            return default
+        return self._rowValues.get(row, {}).get(column, default)
+
+    def appended(self, values):
+        """Records rows that were appended to the sheet"""
+        for rowValues in values:
+            self._lastRow += 1
+            self._rowValues[self._lastRow] = {
+                col: str(rowValues[col - 1]) for col in self._columns if col - 1 < len(rowValues) and rowValues[col - 1] != ""
+            }
+        self._rebuildKeys()
+
+    def deleted(self, rows):
+        """Records rows that were deleted from the sheet, shifting the rows below them up"""
+        removed = sorted(set(rows))
+        removedSet = set(removed)
+        shifted = {}
+        for row, values in self._rowValues.items():
+            if row not in removedSet:
+                shifted[row - bisect.bisect_left(removed, row)] = values
+        self._rowValues = shifted
+        self._lastRow -= bisect.bisect_right(removed, self._lastRow)
+        self._rebuildKeys()
@@ -2,6 +2,10 @@ import gspread
 import logging
 from oauth2client.service_account import ServiceAccountCredentials
 from gspread.exceptions import SpreadsheetNotFound, APIError
+from gspread.http_client import HTTPClient
+from config.registry import registry
+from config.rateLimiter import limiter
+from config.retryPolicy import policy
 
 # ----------------------------------
 # Logging setup
@@ -15,30 +19,52 @@ logging.basicConfig(
 credFile = "config/credentials/credentialsSheets.json"
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
-try:
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(credFile, SCOPE)
-except FileNotFoundError: ##If there is no credentials file
-    logging.error("No credentials file found for the google sheets, login to google cloud and set up")
-    raise
-except Exception as e: ##If there is an error with loading the credentials
-    logging.error(f"Error loading credentials: {e}")
-    raise
+class RateLimitedHTTPClient(HTTPClient):
+    """gspread transport that waits for the shared Sheets (or Drive) budget before each request and retries transient failures"""
+    def _send(self, method, endpoint, *args, **kwargs):
+        if "googleapis.com/drive" in endpoint:
+            limiter("drive").acquire()
+        elif method.lower() == "get":
+            limiter("sheets_read").acquire()
+        else:
+            limiter("sheets_write").acquire()
+        return super().request(method, endpoint, *args, **kwargs)
+
+    def request(self, method, endpoint, *args, **kwargs):
+        return policy("sheets").call(self._send, method, endpoint, *args, **kwargs)
 
-try:
-    client = gspread.authorize(credentials)
-    logging.info("successfully authorised Google Sheets CLient")
-except Exception as e: ##If there is any issue with loading the google sheets file
-    logging.error(f"Failed to authorise Google Sheets client: {e}")
-    raise
+def _authorize():
+    try:
+        credentials = ServiceAccountCredentials.from_json_keyfile_name(credFile, SCOPE)
+    except FileNotFoundError: ##If there is no credentials file
+        logging.error("No credentials file found for the google sheets, login to google cloud and set up")
+        raise
+    except Exception as e: ##If there is an error with loading the credentials
+        logging.error(f"Error loading credentials: {e}")
+        raise
+
+    try:
+        sheetsClient = gspread.authorize(credentials, http_client=RateLimitedHTTPClient)
+        logging.info("successfully authorised Google Sheets CLient")
+        return sheetsClient
+    except Exception as e: ##If there is any issue with loading the google sheets file
+        logging.error(f"Failed to authorise Google Sheets client: {e}")
+        raise
+
+##The client authorises on first use
+client = registry.register("sheets", _authorize)
+_spreadsheets = {} ##Each spreadsheet is only opened once per run
 
 ##Function to safely open google sheets
 def openSheet(sheetName, worksheet = "sheet1"):
     """Safely open a Google Sheet by name with error handling."""
     try:
+        if sheetName not in _spreadsheets:
+            _spreadsheets[sheetName] = client.open(sheetName)
         if worksheet == "sheet1":
-            sheet = client.open(sheetName).sheet1
+            sheet = _spreadsheets[sheetName].sheet1
         else:
-            sheet = client.open(sheetName).worksheet(worksheet)
+            sheet = _spreadsheets[sheetName].worksheet(worksheet)
         logging.info(f"Successfully opened sheet: {sheetName}")
         return sheet
     except SpreadsheetNotFound:
@@ -51,17 +77,12 @@ def openSheet(sheetName, worksheet = "sheet1"):
         logging.error(f"Unexpected error opening '{sheetName}': {e}")
         return None
 
-##Google Sheets Returned
-contentThemes = openSheet("Content Themes")
-scripts = openSheet("Scripts", "Active Scripts")
-slaList = openSheet("SLA Emails")
-published = openSheet("Scripts", "Published")
-unsub = openSheet("Unsubscribe from Wellbeing@UC (Responses)", "Form Responses")
-unsubArchive = openSheet("Unsubscribe from Wellbeing@UC (Responses)", "Form Archive")
-contacts = openSheet("Contact List")
-production = openSheet("Scripts", "Production")
-
-if not all([contentThemes, scripts, slaList, unsub, unsubArchive, contacts, production]):
-    logging.warning("One or more sheets failed to open. Check logs for details.")
-
-
+##Google Sheets Returned, each worksheet is opened the first time a script uses it
+contentThemes = registry.register("Content Themes", openSheet, "Content Themes")
+scripts = registry.register("Scripts/Active Scripts", openSheet, "Scripts", "Active Scripts")
+slaList = registry.register("SLA Emails", openSheet, "SLA Emails")
+published = registry.register("Scripts/Published", openSheet, "Scripts", "Published")
+unsub = registry.register("Unsubscribe/Form Responses", openSheet, "Unsubscribe from Wellbeing@UC (Responses)", "Form Responses")
+unsubArchive = registry.register("Unsubscribe/Form Archive", openSheet, "Unsubscribe from Wellbeing@UC (Responses)", "Form Archive")
+contacts = registry.register("Contact List", openSheet, "Contact List")
+production = registry.register("Scripts/Production", openSheet, "Scripts", "Production")
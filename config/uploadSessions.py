@@ -0,0 +1,114 @@
+from config.retryPolicy import policy
+from googleapiclient.errors import HttpError
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+SESSIONS_FILE = "localStorage/uploadSessions.json"
+##Resumable chunk size, must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+##Google keeps resumable sessions for about a week
+SESSION_LIFETIME = 6 * 24 * 60 * 60
+
+class UploadSessions:
+    """Resumable upload session URIs saved to disk, one per (destination, local file content)"""
+    def __init__(self, path=SESSIONS_FILE):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def _key(self, destination, filePath):
+        ##Size plus the first and last MiB identify the content without hashing a whole video
+        size = os.path.getsize(filePath)
+        digest = hashlib.sha1(str(size).encode())
+        with open(filePath, "rb") as fh:
+            digest.update(fh.read(1024 * 1024))
+            fh.seek(max(0, size - 1024 * 1024))
+            digest.update(fh.read(1024 * 1024))
+        return f"{destination}:{os.path.abspath(filePath)}:{digest.hexdigest()}"
+
+    def _load(self):
+        try:
+            with open(self._path, "r") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self, sessions):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmpPath = self._path + ".tmp"
+        with open(tmpPath, "w") as fh:
+            json.dump(sessions, fh)
+        os.replace(tmpPath, self._path)
+
+    def get(self, destination, filePath):
+        with self._lock:
+            session = self._load().get(self._key(destination, filePath))
+        if session and time.time() - session["created"] < SESSION_LIFETIME:
+            return session["uri"]
+        return None
+
+    def save(self, destination, filePath, uri):
+        with self._lock:
+            sessions = self._load()
+            sessions[self._key(destination, filePath)] = {"uri": uri, "created": time.time()}
+            self._save(sessions)
+
+    def remove(self, destination, filePath):
+        with self._lock:
+            sessions = self._load()
+            if sessions.pop(self._key(destination, filePath), None) is not None:
+                self._save(sessions)
+
+    def upload(self, request, destination, filePath, retries=None):
+        """
+        Runs a resumable upload request to completion and returns the response body.
+        The session URI is saved as soon as it is created, so a rerun after a crash asks the server
+        for its committed offset and only sends the remaining bytes.
+        Each chunk is retried through the destination's policy, e.g. "drive:<folder>" uses the drive policy
+        """
+        retryPolicy = policy(destination.split(":")[0])
+        uri = self.get(destination, filePath)
+        if uri:
+            logging.info(f"Resuming upload session for {filePath}")
+            request.resumable_uri = uri
+            request._in_error_state = True ##next_chunk then queries the committed offset before sending
+
+        def nextChunk():
+            try:
+                return request.next_chunk()
+            except Exception:
+                if request.resumable_uri:
+                    request._in_error_state = True ##The retry asks the server how much arrived before resending
+                raise
+
+        response = None
+        while response is None:
+            try:
+                status, response = retryPolicy.call(nextChunk, retries=retries)
+            except HttpError as e:
+                if uri and e.resp.status in (404, 410): ##Session expired on the server, start a new one
+                    logging.warning(f"Upload session for {filePath} expired, restarting the upload")
+                    self.remove(destination, filePath)
+                    request.resumable_uri = None
+                    request.resumable_progress = 0
+                    request._in_error_state = False
+                    uri = None
+                    continue
+                raise
+            if request.resumable_uri and request.resumable_uri != uri:
+                uri = request.resumable_uri
+                self.save(destination, filePath, uri)
+            if status:
+                print(f"Uploaded {int(status.progress()*100)}%")
+                logging.info(f"Uploaded {int(status.progress()*100)}%")
+        self.remove(destination, filePath)
+        return response
+
+    def pending(self, destination, filePath):
+        """True if an unfinished upload session exists for this file"""
+        return os.path.exists(filePath) and self.get(destination, filePath) is not None
+
+uploadSessions = UploadSessions()
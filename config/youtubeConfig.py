@@ -1,13 +1,10 @@
-import os
 import logging
-import time
-import random
-import google.auth.transport.requests
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from config.discovery import buildService
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
+from config.uploadSessions import uploadSessions, UPLOAD_CHUNK_SIZE
+from config.registry import registry
+from config.credentialManager import credentialManager
 
 ##Logging Setup
 ##---------------------------
@@ -29,24 +26,8 @@ class YoutubeUploader:
         self.authenticate()
 
     def authenticate(self):
-        creds = None
-        if os.path.exists(self._tokenPath):
-            creds = Credentials.from_authorized_user_file(self._tokenPath, SCOPE)
-
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(google.auth.transport.requests.Request())
-                logging.info("Youtube token refreshed successfully.")
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self._credPath, 
-                    SCOPE
-                )
-                creds = flow.run_local_server(port=0, access_type="offline", prompt="consent")
-                logging.info("Youtube authorisation completed, new token saved.")
-            with open(self._tokenPath, "w") as token:
-                token.write(creds.to_json())
-        self._client = build("youtube", "v3", credentials=creds)
+        credentialManager.credentials(self._tokenPath, self._credPath, SCOPE)
+        self._client = buildService("youtube", "v3", http=credentialManager.http(self._tokenPath))
 
     def upload_video(self, file_path, title, description="", category="22", privacy="unlisted", tags=None):
         """
@@ -65,19 +46,15 @@ class YoutubeUploader:
                 "status":{"privacyStatus":privacy}
             }
 
-            media = MediaFileUpload(file_path, chunksize=-1, resumable=True, mimetype='video/*')
+            ##Chunked so a dropped connection or crash only loses the current chunk, the session is resumed on rerun
+            media = MediaFileUpload(file_path, chunksize=UPLOAD_CHUNK_SIZE, resumable=True, mimetype='video/*')
             request = self._client.videos().insert(
                 part="snippet,status",
                 body=body,
                 media_body=media
             )
 
-            response = None
-            while response is None:
-                status, response = request.next_chunk()
-                if status:
-                    logging.info(f"Upload progress: {int(status.progress()*100)}%")
-                    print(f"Upload progress: {int(status.progress()*100)}%")
+            response = uploadSessions.upload(request, "youtube", file_path)
 
             videoId = response.get("id")
             youtubeLink = f"https://youtu.be/{videoId}"
@@ -91,5 +68,5 @@ class YoutubeUploader:
             logging.error(f"Unexpected error when uploading to youtube: {e}")
             return None
         
-youtubeUploader = YoutubeUploader()
+youtubeUploader = registry.register("youtube", YoutubeUploader)
 
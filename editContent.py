@@ -2,12 +2,15 @@ from config.driveConfig import driveClient
 import os
 import random
 import subprocess
-from faster_whisper import WhisperModel
 import logging
 from Logging.ErrorReporting import ErrorNotify
 from config.jsonFiles import DriveFiles
 from func.generateVideo import generateVideo
 from config.sheetsConfig import production
+from config.sheetSession import WriteSession
+from config.sheetTable import KeyedTable
+from func.subtitles import writeSrt
+from func.whisperPool import transcribeAll
 
 LOCAL_AUDIO_DIR = "localStorage/audioDrafts"
 AUDIO_SOURCE_DIR = DriveFiles["Automation"]["1. Add Audio"]
@@ -41,13 +44,6 @@ def safe_subprocess(command, description="command"):
         return False
     return True
 
-def format_time(seconds):
-    millis = int((seconds - int(seconds))*1000)
-    h = int(seconds // 3600)
-    m = int((seconds % 3600) // 60)
-    s = int(seconds % 60)
-    return f"{h:02}:{m:02}:{s:02}.{millis:03}"
-        
 def validate_format(fileName : str, allowedExts : list):
     """Check that the file is in the correct format"""
     ext = os.path.splitext(fileName)[1].lower()
@@ -81,6 +77,97 @@ def addVideo(video_path, audio_path, output_path):
 
         return safe_subprocess(command, "add video to content")
 
+def editVideo(local_file, file_name, musicFiles, finalWithSubs, subsFile):
+    """
+    Builds the finished video with music and subtitles for one downloaded audio file and its prepared subtitles.
+    Returns True on success and False to skip the file
+    """
+    base_name, _ = os.path.splitext(file_name)
+    output_file = os.path.join(LOCAL_AUDIO_DIR, f"mixed_{base_name}.mp3")
+    final = os.path.join(VIDEO_UPLOADS_DIR, "nosub.mp4")
+    inputVideo = None
+    try:
+        choice = random.randint(0, len(musicFiles) - 1)
+        musicChoice = musicFiles[choice] ##Choose one of the music files
+        localMusic = driveClient.cached_download(musicChoice["id"]) ##Music beds are kept in the media cache
+
+        ##Put together with music
+        command = [
+                "ffmpeg",
+                "-y",  # overwrite if exists
+                "-i", local_file,         # voice input
+                "-i", localMusic,         # music input
+                "-filter_complex",
+                "[0:a]volume=1.1[a0];"    # keep voice as-is
+                "[1:a]volume=0.2[a1];"    # lower music volume (20%)
+                "[a0][a1]amix=inputs=2:duration=first:dropout_transition=2[a]",  
+                "-map", "[a]",
+                "-c:a", "mp3",            # output as mp3
+                output_file
+            ]
+        
+        if not safe_subprocess(command, "adding music to content"):
+            return False
+        
+
+        audioMaster = output_file
+        inputVideo = generateVideo(output_file) ###Generate video
+        if not addVideo(inputVideo, audioMaster, final):
+            return False
+
+        ##Add subtitles to the video
+        subtitlesCommand = [
+            "ffmpeg",
+            "-i",
+            final,
+            "-vf",
+            f"subtitles={subsFile}",
+            "-c:a",
+            "copy",
+            finalWithSubs
+        ]
+
+        return safe_subprocess(subtitlesCommand, "Adding subtitles")
+    finally: ##Remove all temp files from local storage
+        for f in [local_file, output_file, final, subsFile, inputVideo]:
+            if f and os.path.exists(f):
+                os.remove(f)
+
+def prepareSubtitles(audioFiles, sidecars, productionTable):
+    """
+    Downloads the whole audio backlog and gets the subtitles of every file ready before any editing starts.
+    Sidecars saved with the audio are used as they are, the rest go through whisper together in one batched pass.
+    Returns {file id: (local audio, subtitle file)}, or None for a file that could not be prepared
+    """
+    downloaded = driveClient.download_files([(file["id"], file["name"]) for file in audioFiles])
+    prepared = {}
+    jobs = []
+    for file, local_file in zip(audioFiles, downloaded):
+        base_name, _ = os.path.splitext(file["name"])
+        ##Named after the Drive id, the theme can hold characters like ' : , that break the ffmpeg subtitles filter
+        subsFile = os.path.join(DOWNLOADS_FOLDER, f"{file['id']}.srt")
+        if local_file is None:
+            logging.error(f"Could not download {file['name']}")
+            prepared[file["id"]] = None
+            continue
+        ##The sidecar already has the exact script with the timings from the voice synthesis
+        sidecar = sidecars.get(base_name)
+        if sidecar is not None and driveClient.download_file(sidecar["id"], os.path.basename(subsFile)) is not None:
+            logging.info(f"Using the subtitle sidecar {sidecar['name']} for {file['name']}")
+            prepared[file["id"]] = (local_file, subsFile)
+            continue
+        jobs.append((file, local_file, subsFile))
+
+    ##Get Subtitles with whisper, the script from the production sheet means only its timings are needed
+    results = transcribeAll([(local_file, productionTable.value(file["id"], 2)) for file, local_file, _ in jobs])
+    for (file, local_file, subsFile), cues in zip(jobs, results):
+        if isinstance(cues, Exception):
+            prepared[file["id"]] = None
+            continue
+        writeSrt(cues, subsFile)
+        prepared[file["id"]] = (local_file, subsFile)
+    return prepared
+
 def main():
     ##Get all of the files in the edit Add audio file
     files = driveClient.list_files_in_folder(AUDIO_SOURCE_DIR)
@@ -92,114 +179,78 @@ def main():
         return False ##Stop the execution of the function
     
 
-    for file in files:
-        file_id = file["id"]
-        file_name = file["name"]
+    productionTable = KeyedTable(production, keyColumn=1, columns=[2]) ##Audio ids and scripts are looked up locally instead of a find per file
+    ##Subtitle sidecars uploaded with the audio, by audio name without the extension
+    sidecars = {os.path.splitext(file["name"])[0]: file for file in files if validate_format(file["name"], [".srt"])}
+
+    def finalPath(file):
+        return os.path.join(VIDEO_UPLOADS_DIR, f"{os.path.splitext(file['name'])[0]}.mp4")
+
+    ##Everything still to edit is downloaded and subtitled up front, files with an unfinished upload only need the upload
+    toEdit = [
+        file for file in files
+        if validate_format(file["name"], [".mp3"]) and not driveClient.has_pending_upload(finalPath(file), DEST_DIR)
+    ]
+    prepared = prepareSubtitles(toEdit, sidecars, productionTable)
+    stopped = False
+    ##Video ids are written to the sheet together when the loop ends, also after an error, the uploads cannot be repeated
+    with WriteSession(production) as productionWrites:
+        for file in files:
+            file_id = file["id"]
+            file_name = file["name"]
         
-        #1. Download Content
-        ##Check for the correct format of the audio file
-        if not validate_format(file_name, [".mp3"]):
-            logging.info(f"skipping {file_name} as it is not mp3")
-            continue
+            ##Check for the correct format of the audio file, sidecars are handled with their audio
+            if validate_format(file_name, [".srt"]):
+                continue
+            if not validate_format(file_name, [".mp3"]):
+                logging.info(f"skipping {file_name} as it is not mp3")
+                continue
 
-        print(f"processing {file_name}...")
-        try:
-            driveClient.download_file(file_id, file_name)
-            choice = random.randint(0, len(musicFiles) - 1)
-            musicChoice = musicFiles[choice] ##Choose one of the music files
-            driveClient.download_file(musicChoice["id"], musicChoice["name"])
-            
-            ##Get Subtitles with whisper
-            subsFile = DOWNLOADS_FOLDER + "/subs.srt"
-
-            ##Establish the files for use
+            print(f"processing {file_name}...")
             base_name, _ = os.path.splitext(file_name)
-            output_file = os.path.join(LOCAL_AUDIO_DIR, f"mixed_{base_name}.mp3")
-            local_file = os.path.join(DOWNLOADS_FOLDER, file_name)
-            localMusic = os.path.join(DOWNLOADS_FOLDER, musicChoice["name"])
-
+            finalWithSubs = finalPath(file)
+            subtitleFile = sidecars.get(base_name)
             try:
-                model = WhisperModel("small", device="cpu", compute_type="int8")
-                logging.info(f"Successfully loaded whisper Model: {model}")
-                segments, info = model.transcribe(local_file, beam_size=5)
-                with open(subsFile, "w", encoding="utf-8") as srtFile:
-                    ##Convert seconds to srt timestamp format
-                    for i, segment in enumerate(segments, start=1):
-                        
-                        start = segment.start
-                        end = segment.end
-                        text = segment.text.strip()
-
-                        srtFile.write(f"{i}\n{format_time(start)} --> {format_time(end)}\n{text}\n\n")
-                logging.info(f"Successfully transcribed subtitles for {local_file}")
-            except Exception as e:
-                logging.error(f"Whisper transcription failed for {file_name}: {e}")
-                return False ##Stop excecution
-            
-
-            ##Put together with music
-            command = [
-                    "ffmpeg",
-                    "-y",  # overwrite if exists
-                    "-i", local_file,         # voice input
-                    "-i", localMusic,         # music input
-                    "-filter_complex",
-                    "[0:a]volume=1.1[a0];"    # keep voice as-is
-                    "[1:a]volume=0.2[a1];"    # lower music volume (20%)
-                    "[a0][a1]amix=inputs=2:duration=first:dropout_transition=2[a]",  
-                    "-map", "[a]",
-                    "-c:a", "mp3",            # output as mp3
-                    output_file
-                ]
-            
-            if not safe_subprocess(command, "adding music to content"):
-                continue
-            
+                ##A previous run stopped part way through uploading this video, so carry on with that upload
+                if file_id not in prepared:
+                    logging.info(f"Resuming the unfinished upload of {finalWithSubs}")
+                else:
+                    if prepared[file_id] is None:
+                        logging.error(f"No subtitles could be prepared for {file_name}")
+                        stopped = True ##Stop excecution
+                        break
+                    local_file, subsFile = prepared.pop(file_id)
+                    if not editVideo(local_file, file_name, musicFiles, finalWithSubs, subsFile):
+                        continue
 
-            audioMaster = output_file
-            final = os.path.join(VIDEO_UPLOADS_DIR, "nosub.mp4")
-            inputVideo = generateVideo(output_file) ###Generate video
-            if not addVideo(inputVideo, audioMaster, final):
-                continue
+                ##Upload the audio with music
+                videoId = driveClient.upload_file(finalWithSubs, DEST_DIR, "video/mp4")
+                logging.info(f"Successfully uploaded {finalWithSubs} to the drive")
+                # Move originals to archive
+                driveClient.move_file(file_id, ARCHIVE_FOLDER)
+                if subtitleFile is not None:
+                    driveClient.move_file(subtitleFile["id"], ARCHIVE_FOLDER)
+                logging.info(f"Successfully moved the audio file to the Archive")
 
-            finalWithSubs = os.path.join(VIDEO_UPLOADS_DIR, f"{base_name}.mp4")
-            ##Add subtitles to the video
-            subtitlesCommand = [
-                "ffmpeg",
-                "-i",
-                final,
-                "-vf",
-                f"subtitles={subsFile}",
-                "-c:a",
-                "copy",
-                finalWithSubs
-            ]
+                ##Update the progress spreadsheet with the script
+                productionRow = productionTable.row(file_id)
 
-            if not safe_subprocess(subtitlesCommand, "Adding subtitles"):
-                continue ##Continue if unable to add subtitles
-
-            
-            ##Upload the audio with music
-            videoId = driveClient.upload_file(finalWithSubs, DEST_DIR, "video/mp4")
-            logging.info(f"Successfully uploaded {finalWithSubs} to the drive")
-            # Move originals to archive
-            driveClient.move_file(file_id, ARCHIVE_FOLDER)
-            logging.info(f"Successfully moved the audio file to the Archive")
-
-            ##Update the progress spreadsheet with the script
-            productionCell = production.find(file_id, in_column=1)
-
-            ##This allows the script to be associated with the video created
-            if productionCell is not None:
-                production.update_cell(productionCell.row, 4,videoId)
-
-        except Exception as e:
-            logging.error(f"Unexpected error processing {file_name}: {e}")
-        finally: ##Remove all temp files from local storage
-            for f in [local_file, localMusic, output_file, final, finalWithSubs, subsFile, inputVideo]:
-                if f and os.path.exists(f):
-                    os.remove(f)
-    return True
+                ##This allows the script to be associated with the video created
+                if productionRow is not None:
+                    productionWrites.update_cell(productionRow, 4,videoId)
+
+            except Exception as e:
+                logging.error(f"Unexpected error processing {file_name}: {e}")
+            finally:
+                ##Keep the edited video while its upload is unfinished so the next run can resume it
+                if os.path.exists(finalWithSubs) and not driveClient.has_pending_upload(finalWithSubs, DEST_DIR):
+                    os.remove(finalWithSubs)
+    ##Files left over after a stop are removed so the next run starts clean
+    for paths in prepared.values():
+        for path in paths or []:
+            if os.path.exists(path):
+                os.remove(path)
+    return not stopped
 
 if __name__ == "__main__":
     if main():
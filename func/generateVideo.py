@@ -23,14 +23,11 @@ def generateVideo(voiceFile):
             logging.warning(f"Requested {noVids} but only had {len(videoClips)}")
             noVids = len(videoClips)
         listOfNumbers = random.sample(range(len(videoClips)), noVids)
-        vidsList = []
-        count = 1
-        for i in listOfNumbers:
-            fileId = videoClips[i]["id"]
-            tempName = f"stitch_{count}.mp4"
-            driveClient.download_file(fileId, tempName)
-            vidsList.append(tempName)
-            count += 1
+        ##Fetch every chosen clip at once, clips already in the media cache are not downloaded again
+        paths = driveClient.cached_download_files([videoClips[i]["id"] for i in listOfNumbers])
+        vidsList = [os.path.abspath(path) for path in paths if path is not None]
+        if not vidsList:
+            raise RuntimeError("None of the video clips could be downloaded")
         
         ##Create a text file for all the videos
         videosTxt = "localStorage/downloads/videos.txt"
@@ -58,12 +55,7 @@ def generateVideo(voiceFile):
         logging.info("Video successfully created")
         
 
-        ##Remove all of the files
-        for vid in vidsList:
-            try:
-                os.remove("localStorage/downloads/"+ vid)
-            except Exception as e:
-                logging.error(f"Could not delete {vid}: {e}")
+        ##The clips stay in the media cache, only the concat list is removed
         os.remove(videosTxt)
         return "localStorage/videos/video.mp4"
     except Exception as e:
@@ -5,8 +5,12 @@ os.makedirs("localStorage",exist_ok=True)
 
 storageSubs = [
     "audioDrafts",
+    "cache",
     "convertedVideos",
     "downloads",
+    "pdfText",
+    "rateLimits",
+    "ttsCache",
     "uploadVideos",
     "videos"
 ]
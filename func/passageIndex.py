@@ -0,0 +1,104 @@
+from func.pdfText import pdfPages
+from collections import Counter
+import logging
+import math
+import os
+import re
+
+##Passage size in words and the words shared with the next passage so an idea is not cut in half
+PASSAGE_WORDS = int(os.getenv("PASSAGE_WORDS", 150))
+PASSAGE_OVERLAP = int(os.getenv("PASSAGE_OVERLAP", 30))
+##Approximate number of prompt tokens spent on book passages
+PASSAGE_TOKEN_BUDGET = int(os.getenv("PASSAGE_TOKEN_BUDGET", 1500))
+PASSAGE_TOP_K = int(os.getenv("PASSAGE_TOP_K", 8))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "have", "how", "in", "into",
+    "is", "it", "its", "of", "on", "or", "that", "the", "their", "them", "they", "this", "to", "was", "we",
+    "were", "what", "when", "which", "who", "will", "with", "you", "your",
+}
+
+def tokenise(text):
+    return [word for word in re.findall(r"[a-z0-9']+", text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+def estimateTokens(text):
+    return len(text) // 4 ##About four characters a token
+
+def chunk(text, size=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    """Splits text into overlapping passages of about `size` words"""
+    words = text.split()
+    step = max(1, size - overlap)
+    return [" ".join(words[start:start + size]) for start in range(0, max(1, len(words) - overlap), step)]
+
+class PassageIndex:
+    """
+    BM25 ranking over fixed size passages of the cached chapter text.
+    A chapter that cannot be loaded is left out and logged, .chapters holds the ones that were indexed
+    """
+    def __init__(self, chapterIds, k1=1.5, b=0.75):
+        self._k1 = k1
+        self._b = b
+        self.passages = [] ##(chapterId, text)
+        self.chapters = []
+        self._terms = []
+        for chapterId in chapterIds:
+            try:
+                pages = pdfPages(chapterId)
+            except Exception as e:
+                logging.error(f"Could not load the text of chapter {chapterId}, it is left out of the index: {e}")
+                continue
+            self.chapters.append(chapterId)
+            for passage in chunk("\n".join(pages)):
+                if passage:
+                    self.passages.append((chapterId, passage))
+                    self._terms.append(Counter(tokenise(passage)))
+        self._averageLength = sum(sum(terms.values()) for terms in self._terms) / max(1, len(self._terms))
+        documentFrequency = Counter(term for terms in self._terms for term in terms)
+        count = len(self._terms)
+        self._idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in documentFrequency.items()}
+
+    def _score(self, terms, query):
+        length = sum(terms.values())
+        score = 0.0
+        for term in query:
+            frequency = terms.get(term, 0)
+            if frequency:
+                norm = self._k1 * (1 - self._b + self._b * length / self._averageLength)
+                score += self._idf[term] * frequency * (self._k1 + 1) / (frequency + norm)
+        return score
+
+    def search(self, query, k=PASSAGE_TOP_K, chapterId=None):
+        """
+        Indices of the best passages for a query, highest score first, passages with no matching term are left out.
+        With a chapterId only that chapter's passages are ranked
+        """
+        queryTerms = set(tokenise(query))
+        scores = [
+            (self._score(terms, queryTerms), index) for index, terms in enumerate(self._terms)
+            if chapterId is None or self.passages[index][0] == chapterId
+        ]
+        ranked = sorted((pair for pair in scores if pair[0] > 0), key=lambda pair: -pair[0])
+        return [index for _, index in ranked[:k]]
+
+    def context(self, query, chapterId=None, budget=PASSAGE_TOKEN_BUDGET, k=PASSAGE_TOP_K):
+        """
+        The top passages of chapterId for a query joined for a prompt, kept within a token budget.
+        When nothing matches, the opening passages of the chapter are used instead.
+        A chapter that is not in the index falls back to searching every chapter that is
+        """
+        if chapterId is not None and chapterId not in self.chapters:
+            logging.warning(f"Chapter {chapterId} is not in the index, using passages from the other chapters")
+            chapterId = None
+        indices = self.search(query, k, chapterId)
+        if not indices and chapterId is not None:
+            indices = [index for index, (passageChapter, _) in enumerate(self.passages) if passageChapter == chapterId][:k]
+        chosen = []
+        used = 0
+        for index in indices:
+            text = self.passages[index][1]
+            cost = estimateTokens(text)
+            if chosen and used + cost > budget:
+                break
+            chosen.append(text)
+            used += cost
+        return "\n\n".join(chosen)
@@ -0,0 +1,60 @@
+from config.driveConfig import driveClient
+from concurrent.futures import ProcessPoolExecutor
+import pdfplumber
+import json
+import logging
+import os
+
+PDF_TEXT_DIR = "localStorage/pdfText"
+##Processes used to extract a chapter that is not cached yet
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+
+def _extractPages(path, start, end):
+    """Text of pages [start, end) of a pdf, run in a worker process"""
+    pages = []
+    with pdfplumber.open(path, pages=range(start + 1, end + 1)) as pdf: ##pdfplumber numbers pages from 1
+        for page in pdf.pages:
+            pages.append(page.extract_text() or "")
+            page.flush_cache() ##Drop the parsed layout so memory stays at one page per worker
+    return pages
+
+def extractPages(path, workers=PDF_WORKERS):
+    """Text of every page of a local pdf, page ranges are split across a process pool"""
+    with pdfplumber.open(path) as pdf:
+        pageCount = len(pdf.pages)
+    if pageCount == 0:
+        return []
+    workers = max(1, min(workers, pageCount))
+    step = -(-pageCount // workers) ##Ceiling division so every page is covered
+    ranges = [(start, min(start + step, pageCount)) for start in range(0, pageCount, step)]
+    if len(ranges) == 1:
+        return _extractPages(path, 0, pageCount)
+    pages = []
+    with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        for rangePages in pool.map(_extractPages, [path] * len(ranges), *zip(*ranges)):
+            pages.extend(rangePages)
+    return pages
+
+def pdfPages(fileId):
+    """
+    Text of each page of a Drive pdf.
+    The pages are cached under the file id and md5, so the pdf is only downloaded and parsed when it changes
+    """
+    md5 = driveClient.get_metadata(fileId).get("md5Checksum", "")
+    cachePath = os.path.join(PDF_TEXT_DIR, f"{fileId}_{md5}.json")
+    try:
+        with open(cachePath, "r") as fh:
+            pages = json.load(fh)["pages"]
+        logging.info(f"Using the cached text of {fileId}")
+    except (FileNotFoundError, ValueError, KeyError):
+        path = driveClient.cached_download(fileId) ##Chapters rarely change so they are kept in the media cache
+        if path is None:
+            raise RuntimeError(f"Could not download {fileId}, see drive_config.log for details")
+        pages = extractPages(path)
+        os.makedirs(PDF_TEXT_DIR, exist_ok=True)
+        tmpPath = cachePath + ".tmp"
+        with open(tmpPath, "w") as fh:
+            json.dump({"fileId": fileId, "md5Checksum": md5, "pages": pages}, fh)
+        os.replace(tmpPath, cachePath)
+        logging.info(f"Extracted and cached {len(pages)} pages of {fileId}")
+    return pages
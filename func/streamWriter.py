@@ -0,0 +1,44 @@
+import logging
+import os
+
+def _partPath(path):
+    return path + ".part"
+
+def _discard(partPath):
+    if os.path.exists(partPath):
+        os.remove(partPath)
+
+def writeStream(chunks, path):
+    """
+    Writes an iterable of byte chunks to path as they arrive, only one chunk is held in memory.
+    The data goes to a .part file that is renamed over path once the stream has ended, so a broken stream never leaves a partial file behind
+    """
+    partPath = _partPath(path)
+    written = 0
+    try:
+        with open(partPath, "wb") as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+                written += len(chunk)
+        os.replace(partPath, path)
+    except BaseException:
+        _discard(partPath)
+        raise
+    logging.info(f"Streamed {written} bytes to {path}")
+    return path
+
+async def writeStreamAsync(chunks, path):
+    """writeStream for an async iterable of byte chunks"""
+    partPath = _partPath(path)
+    written = 0
+    try:
+        with open(partPath, "wb") as fh:
+            async for chunk in chunks:
+                fh.write(chunk)
+                written += len(chunk)
+        os.replace(partPath, path)
+    except BaseException:
+        _discard(partPath)
+        raise
+    logging.info(f"Streamed {written} bytes to {path}")
+    return path
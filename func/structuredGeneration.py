@@ -0,0 +1,113 @@
+from config.openaiConfig import openaiClient, asyncOpenaiClient
+from config.retryPolicy import policy
+import json
+import logging
+import re
+
+MODEL = "gpt-4o-mini"
+
+def _schema(field):
+    ##Structured output keeps the reply to exactly one string field, no preamble or markdown around it
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{field}_response",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {field: {"type": "string"}},
+                "required": [field],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+def _request(messages, field):
+    response = policy("openai").call(
+        openaiClient.chat.completions.create,
+        model=MODEL,
+        messages=messages,
+        response_format=_schema(field)
+    )
+    return response.choices[0].message.content
+
+def _parse(content, field):
+    """The field's text from a JSON reply, None if the reply is not usable"""
+    try:
+        value = json.loads(content or "")[field]
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()
+
+def scriptProblems(script):
+    """Reasons a script cannot go straight to text to speech, empty when it is fine"""
+    problems = []
+    firstLine = script.splitlines()[0]
+    if re.match(r"^\s*(#|\*\*|title\s*:|script\s*:)", firstLine, re.IGNORECASE):
+        problems.append("it starts with a title or heading")
+    if re.search(r"\[[^\]]*\]|\((pause|music|sound|narrator|voice ?over|beat)[^)]*\)", script, re.IGNORECASE):
+        problems.append("it contains stage directions in brackets")
+    if re.search(r"^\s*(narrator|speaker|host)\s*:", script, re.IGNORECASE | re.MULTILINE):
+        problems.append("it contains speaker labels")
+    return problems
+
+def descriptionProblems(description):
+    """Reasons a description is not a single clean paragraph, empty when it is fine"""
+    problems = []
+    if re.search(r"\n\s*\n", description):
+        problems.append("it has more than one paragraph")
+    if re.match(r"^\s*(#|\*\*|description\s*:|title\s*:)", description, re.IGNORECASE):
+        problems.append("it starts with a heading or label")
+    return problems
+
+def _check(content, field, validate):
+    value = _parse(content, field)
+    problems = ["the reply was not valid JSON with a non empty field"] if value is None else validate(value)
+    return value, problems
+
+def _repairMessages(messages, content, field, problems):
+    logging.warning(f"Generated {field} failed validation ({'; '.join(problems)}), asking for a repair")
+    return messages + [
+        {"role": "assistant", "content": content or ""},
+        {"role": "user", "content": f"Please fix the {field} because {'; '.join(problems)}. Return only the corrected {field}."},
+    ]
+
+def _repaired(value, content, field, validate):
+    repaired, remaining = _check(content, field, validate)
+    if repaired is None:
+        return value
+    if remaining:
+        logging.warning(f"Repaired {field} still has problems: {'; '.join(remaining)}")
+    return repaired
+
+def generateField(prompt, field, validate):
+    """
+    Asks for a JSON reply holding one text field and checks it locally.
+    A second repair call is only made when the reply fails validation, returns None if no usable text came back
+    """
+    messages = [{"role": "user", "content": prompt}]
+    content = _request(messages, field)
+    value, problems = _check(content, field, validate)
+    if not problems:
+        return value
+    return _repaired(value, _request(_repairMessages(messages, content, field, problems), field), field, validate)
+
+async def _requestAsync(messages, field):
+    response = await policy("openai").acall(
+        asyncOpenaiClient.chat.completions.create,
+        model=MODEL,
+        messages=messages,
+        response_format=_schema(field)
+    )
+    return response.choices[0].message.content
+
+async def generateFieldAsync(prompt, field, validate):
+    """generateField on the async client, for generating several fields at once"""
+    messages = [{"role": "user", "content": prompt}]
+    content = await _requestAsync(messages, field)
+    value, problems = _check(content, field, validate)
+    if not problems:
+        return value
+    return _repaired(value, await _requestAsync(_repairMessages(messages, content, field, problems), field), field, validate)
@@ -0,0 +1,137 @@
+import base64
+import difflib
+import os
+import re
+
+##Longest subtitle line before a cue is split, and the longest a cue stays on screen
+SUBTITLE_MAX_CHARS = int(os.getenv("SUBTITLE_MAX_CHARS", 42))
+SUBTITLE_MAX_SECONDS = float(os.getenv("SUBTITLE_MAX_SECONDS", 5))
+
+def srtTime(seconds):
+    millis = int(round(seconds * 1000))
+    h, millis = divmod(millis, 3600000)
+    m, millis = divmod(millis, 60000)
+    s, millis = divmod(millis, 1000)
+    return f"{h:02}:{m:02}:{s:02},{millis:03}"
+
+def subtitlePath(audioPath):
+    """The sidecar subtitle file that belongs to an audio file, e.g. Calm.mp3 -> Calm.srt"""
+    return os.path.splitext(audioPath)[0] + ".srt"
+
+class CharacterTimeline:
+    """Collects the character alignment ElevenLabs returns alongside the audio and turns it into timed words"""
+    def __init__(self):
+        self._characters = []
+        self._starts = []
+        self._ends = []
+
+    def add(self, alignment):
+        if alignment is None or not alignment.characters:
+            return
+        starts = list(alignment.character_start_times_seconds)
+        ends = list(alignment.character_end_times_seconds)
+        ##Chunks timed from their own start are moved after the audio that came before them
+        offset = 0.0
+        if self._ends and starts[0] < self._ends[-1] - 0.05:
+            offset = self._ends[-1] - starts[0]
+        self._characters.extend(alignment.characters)
+        self._starts.extend(start + offset for start in starts)
+        self._ends.extend(end + offset for end in ends)
+
+    def words(self):
+        """(word, start, end) for every whitespace separated word"""
+        words = []
+        current, start, end = "", None, None
+        for character, charStart, charEnd in zip(self._characters, self._starts, self._ends):
+            if character.isspace():
+                if current:
+                    words.append((current, start, end))
+                current, start = "", None
+                continue
+            if start is None:
+                start = charStart
+            current += character
+            end = charEnd
+        if current:
+            words.append((current, start, end))
+        return words
+
+def audioChunks(stream, timeline):
+    """Audio bytes from a stream_with_timestamps response, the alignment of each chunk goes into the timeline"""
+    for chunk in stream:
+        timeline.add(chunk.alignment)
+        if chunk.audio_base_64:
+            yield base64.b64decode(chunk.audio_base_64)
+
+async def audioChunksAsync(stream, timeline):
+    async for chunk in stream:
+        timeline.add(chunk.alignment)
+        if chunk.audio_base_64:
+            yield base64.b64decode(chunk.audio_base_64)
+
+def groupCues(words, maxChars=SUBTITLE_MAX_CHARS, maxSeconds=SUBTITLE_MAX_SECONDS):
+    """Groups timed words into (start, end, text) cues, breaking after sentences or when a cue gets too long"""
+    cues = []
+    current = []
+    for word in words:
+        if current:
+            text = " ".join(w[0] for w in current + [word])
+            if len(text) > maxChars or word[2] - current[0][1] > maxSeconds:
+                cues.append((current[0][1], current[-1][2], " ".join(w[0] for w in current)))
+                current = []
+        current.append(word)
+        if re.search(r"[.!?]['\"]?$", word[0]):
+            cues.append((current[0][1], current[-1][2], " ".join(w[0] for w in current)))
+            current = []
+    if current:
+        cues.append((current[0][1], current[-1][2], " ".join(w[0] for w in current)))
+    return cues
+
+def writeSrt(cues, path):
+    """Writes (start, end, text) cues as an SRT file, renamed into place once complete"""
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w", encoding="utf-8") as srtFile:
+        for i, (start, end, text) in enumerate(cues, start=1):
+            srtFile.write(f"{i}\n{srtTime(start)} --> {srtTime(end)}\n{text.strip()}\n\n")
+    os.replace(tmpPath, path)
+    return path
+
+def _normalise(word):
+    return re.sub(r"[^a-z0-9']", "", word.lower())
+
+def alignScript(script, recognised, duration=None):
+    """
+    Times every word of the known script from a rough recognition pass.
+    recognised is a list of (word, start, end); script words that were matched take its timings and the ones in between
+    are spread across the gap by length, so the cues always carry the script's exact text
+    """
+    words = script.split()
+    if not words:
+        return []
+    matcher = difflib.SequenceMatcher(None, [_normalise(w) for w in words], [_normalise(w[0]) for w in recognised], autojunk=False)
+    times = [None] * len(words)
+    for block in matcher.get_matching_blocks():
+        for offset in range(block.size):
+            _, start, end = recognised[block.b + offset]
+            times[block.a + offset] = (start, end)
+
+    end = duration if duration is not None else (recognised[-1][2] if recognised else 0.0)
+    index = 0
+    while index < len(words):
+        if times[index] is not None:
+            index += 1
+            continue
+        ##A run of unmatched words sits between the previous matched word and the next one
+        runEnd = index
+        while runEnd < len(words) and times[runEnd] is None:
+            runEnd += 1
+        gapStart = times[index - 1][1] if index > 0 else 0.0
+        gapEnd = times[runEnd][0] if runEnd < len(words) else max(end, gapStart)
+        lengths = [len(w) + 1 for w in words[index:runEnd]]
+        position = gapStart
+        for i, length in zip(range(index, runEnd), lengths):
+            step = (gapEnd - gapStart) * length / sum(lengths)
+            times[i] = (position, position + step)
+            position += step
+        index = runEnd
+    return [(word, start, end) for word, (start, end) in zip(words, times)]
@@ -0,0 +1,20 @@
+from config.mediaCache import MediaCache
+import hashlib
+import json
+import os
+import unicodedata
+
+TTS_CACHE_DIR = "localStorage/ttsCache"
+##Bytes of synthesised audio kept before the least recently used clips are evicted
+TTS_CACHE_BUDGET = int(os.getenv("TTS_CACHE_BYTES", 1024 * 1024 * 1024))
+
+ttsCache = MediaCache(TTS_CACHE_DIR, TTS_CACHE_BUDGET)
+
+def normaliseScript(text):
+    """Unicode and whitespace differences do not change the speech, so they do not change the key"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def ttsKey(text, voiceId, modelId, outputFormat):
+    """Cache key for one synthesis, the extension comes from the output format, e.g. mp3_44100_128 -> .mp3"""
+    digest = hashlib.sha256(json.dumps([normaliseScript(text), voiceId, modelId, outputFormat]).encode()).hexdigest()
+    return f"{digest}.{outputFormat.split('_')[0]}"
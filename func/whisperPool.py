@@ -0,0 +1,69 @@
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from concurrent.futures import ThreadPoolExecutor
+from func.subtitles import alignScript, groupCues
+import logging
+import os
+import threading
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+##Files transcribed at the same time, each gets an equal share of the cores
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", 2))
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", max(1, (os.cpu_count() or 1) // WHISPER_WORKERS)))
+##Audio chunks decoded together by the batched pipeline
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", 8))
+
+_pipelines = {}
+_lock = threading.Lock()
+
+def whisperPipeline(size=WHISPER_MODEL):
+    """Batched pipeline over a model that is loaded once per process and shared by every transcription"""
+    with _lock:
+        if size not in _pipelines:
+            model = WhisperModel(
+                size,
+                device="cpu",
+                compute_type="int8",
+                cpu_threads=WHISPER_CPU_THREADS,
+                num_workers=WHISPER_WORKERS ##Lets the worker threads run the model concurrently
+            )
+            logging.info(f"Loaded whisper model {size} with {WHISPER_CPU_THREADS} threads for {WHISPER_WORKERS} workers")
+            _pipelines[size] = BatchedInferencePipeline(model=model)
+        return _pipelines[size]
+
+def subtitleCues(audioPath, script=""):
+    """
+    (start, end, text) subtitle cues for one audio file.
+    With the script known, a greedy pass only times its words and the cues carry the script exactly,
+    otherwise the audio is transcribed freely with a beam search
+    """
+    pipeline = whisperPipeline()
+    if script:
+        segments, info = pipeline.transcribe(
+            audioPath,
+            beam_size=1,
+            best_of=1,
+            temperature=0,
+            word_timestamps=True,
+            initial_prompt=script,
+            batch_size=WHISPER_BATCH_SIZE
+        )
+        recognised = [(word.word.strip(), word.start, word.end) for segment in segments for word in segment.words]
+        logging.info(f"Aligned the production script to {audioPath}")
+        return groupCues(alignScript(script, recognised, info.duration))
+    segments, info = pipeline.transcribe(audioPath, beam_size=5, batch_size=WHISPER_BATCH_SIZE)
+    cues = [(segment.start, segment.end, segment.text) for segment in segments]
+    logging.info(f"Successfully transcribed subtitles for {audioPath}")
+    return cues
+
+def transcribeAll(jobs):
+    """Subtitle cues for several (audioPath, script) jobs at once, one list of cues or exception per job in order"""
+    def _run(job):
+        try:
+            return subtitleCues(*job)
+        except Exception as e:
+            logging.error(f"Whisper transcription failed for {job[0]}: {e}")
+            return e
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=WHISPER_WORKERS) as pool:
+        return list(pool.map(_run, jobs))
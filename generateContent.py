@@ -1,14 +1,21 @@
 from config.sheetsConfig import contentThemes, production
-from config.openaiConfig import openaiClient
 from config.driveConfig import driveClient
-from config.elevenlabsConfig import elClient
-from openai import RateLimitError, APIError, APIConnectionError, Timeout
+from config.elevenlabsConfig import elClient, asyncElClient, ttsSlots
 import os
-import pdfplumber
+import shutil
 import logging
-import time
 from Logging.ErrorReporting import ErrorNotify
 from config.jsonFiles import DriveFiles
+from config.sheetSession import WriteSession
+from config.sheetSnapshot import getRecords
+from config.retryPolicy import policy
+from func.passageIndex import PassageIndex
+from func.streamWriter import writeStream, writeStreamAsync
+from func.ttsCache import ttsCache, ttsKey
+from func.subtitles import CharacterTimeline, audioChunks, audioChunksAsync, groupCues, writeSrt, subtitlePath
+from func.structuredGeneration import generateField, generateFieldAsync, scriptProblems
+import argparse
+import asyncio
 import datetime
 
 
@@ -28,10 +35,18 @@ AUDIO_DEST_FOLDER = DriveFiles["Automation"]["1. Add Audio"]
 COMPRESSED_AUDIO_FOLDER = "compressedAudio"
 AUDIO_DRAFTS_FOLDER = "localStorage/audioDrafts"
 
+##Drive ids of the book chapters, keyed by the Chapter column of the Content Themes sheet
+BOOK_CHAPTERS = {
+    3: '1vfwQt9MgaE2J6tiN0mxFHjh-KkzjZ2cx',
+    2: '1uqBKCtpzxCcoFKbbz8-NnTLPnksrXi3G',
+    1: '108DBJkVciwSwnnCCphIdZvMOXUevmH85',
+}
+
 def getTodaysTheme(contentThemes): ##Sould only ever return 1 dictionary for todays theme
     count = 2
     outRow = []
-    rows = contentThemes.get_all_records()
+    rows = getRecords(contentThemes)
+    themeWrites = WriteSession(contentThemes) ##All the Used fixes are written in one request
     ##Return all the items in the spreadsheet that have Used == 1
     
     for row in rows:
@@ -39,7 +54,7 @@ def getTodaysTheme(contentThemes): ##Sould only ever return 1 dictionary for tod
             used = int(row["Used"]) ##Test that the data value for the Used column is valid
         except Exception as e:
             logging.warning(f"Used value for row {count} of the Content Themes spreadsheet is not 1 or 0")
-            contentThemes.update_cell(count, 4, 0) ###Set the invalid Used row to 0
+            themeWrites.update_cell(count, 4, 0) ###Set the invalid Used row to 0
             used = 0
         if used >= 1:
             outRow.append(row)
@@ -47,196 +62,300 @@ def getTodaysTheme(contentThemes): ##Sould only ever return 1 dictionary for tod
         count += 1
     ##Error handling
     if len(outRow) == 0: ##If all the Used rows are 0, return to the top row
-        contentThemes.update_cell(2, 4, 1) ##Set the top row to 1
+        themeWrites.update_cell(2, 4, 1) ##Set the top row to 1
         outRow = rows[0] ##Return the top row for content generation
         outRow["id"] = 2 ##Record the position of the row
     elif len(outRow) > 1: ##If there are more than 1 rows with the Used column set to 1
         topRow = outRow[0] ##Save the top most element
         for row in outRow: ##Set all row elements with 1 back to 0
-            contentThemes.update_cell(row["id"], 4, 0)
-        contentThemes.update_cell(topRow["id"], 4, 1) ##Set the top element with used 1 back to 1
+            themeWrites.update_cell(row["id"], 4, 0)
+        themeWrites.update_cell(topRow["id"], 4, 1) ##Set the top element with used 1 back to 1
         outRow = topRow
     else:
         outRow = outRow[0]
+    themeWrites.commit()
     return outRow, len(rows)
 
-def main():
-    print("Loading todays theme")
-    logging.info("\n\n*****************GENERATING CONTENT*********************")
-    todaysTheme, rowCount = getTodaysTheme(contentThemes) ##Return todays theme for content generation
-    logging.info("(1/8) -> Theme successfully generated: {}".format(todaysTheme["Theme"]))
+VOICE_ID = "bwBMii6YyaA3YprSpbXH"  # Use Ehssans voice
+TTS_MODEL = "eleven_multilingual_v2"
+TTS_FORMAT = "mp3_44100_128"
+##Script requests run at the same time in batch mode, ElevenLabs is bounded by its shared slots
+OPENAI_BATCH_CONCURRENCY = int(os.getenv("OPENAI_BATCH_CONCURRENCY", 4))
 
-    ##Load the book chapter from the drive
-    #-------------------------------------
-    bookChapters = {
-        3: '1vfwQt9MgaE2J6tiN0mxFHjh-KkzjZ2cx',
-        2: '1uqBKCtpzxCcoFKbbz8-NnTLPnksrXi3G',
-        1: '108DBJkVciwSwnnCCphIdZvMOXUevmH85',
-    }
+def buildPrompt(theme, activity, chapterText):
+    ##This will generate a prompt for chat gpt for if there is or is not a prompt
+    if not activity:
+        prompt = f"Are you able to read the below text and create a 30 second to 1 minute text to speech script about {theme} The video should include an activiy that relates to the topic, preferbably with reference to the text."
+    else:
+        prompt = f"Are you able to read the below text and create a 30 second to 1 minute text to speech script about {theme}. The video should include an activity for the viewer based around {activity}."
+    ##The script goes straight into Elevenlabs, so the cleanup instructions are part of the one request
+    prompt += f" The script field will be entered directly into Elevenlabs text-to-speech, so it should only contain the spoken words with no title, headings, stage directions or speaker labels. The text is: {chapterText}"
+    return prompt
 
-    ##Select the book chapter based on the data from todays theme
-    print("Loading the book")
-    chapterId = bookChapters[todaysTheme["Chapter"]]
-    workingChapter = driveClient.download_file(chapterId, "workingChapter.pdf")
-    if workingChapter is None:
-        logging.error("Could not download chapter, see drive_config.log for details")
-        return False ##Log where the error occurred and stop the iteration
-    logging.info(f"(2/8) -> Successfully downloaded {workingChapter}")
+def themePrompt(theme, passages):
+    ##Only the passages of the theme's chapter most relevant to the theme and activity go into the prompt
+    chapterText = passages.context(f"{theme['Theme']} {theme['Activity']}", BOOK_CHAPTERS[theme["Chapter"]])
+    logging.info(f"Selected {len(chapterText)} characters of passages for {theme['Theme']}")
+    return buildPrompt(theme["Theme"], theme["Activity"], chapterText)
 
-    ##Extract the text from the pdf file to be fed into chat gpt
-    print("extracting the text")
-    chapterText = ""
+def audioPath(theme):
+    os.makedirs(AUDIO_DRAFTS_FOLDER, exist_ok=True)
+    return AUDIO_DRAFTS_FOLDER + "/" + theme.capitalize().strip() + ".mp3"
+
+def scriptPath(theme):
+    return os.path.splitext(audioPath(theme))[0] + ".txt"
+
+def draftScript(theme):
+    """The script kept from an earlier run that failed after generating it, so a rerun synthesises the same text from the TTS cache"""
     try:
-        with pdfplumber.open(workingChapter) as pdf:
-            for page in pdf.pages:
-                chapterText += page.extract_text() + "\n"
-    except Exception as e:
-        logging.error(f"unexpected error with pdfplumber: {e}")
+        with open(scriptPath(theme), "r", encoding="utf-8") as fh:
+            script = fh.read()
+        logging.info(f"Reusing the draft script for {theme}")
+        return script or None
+    except FileNotFoundError:
+        return None
+
+def saveDraftScript(theme, script):
+    with open(scriptPath(theme), "w", encoding="utf-8") as fh:
+        fh.write(script)
+
+def clearDraft(theme, audioName):
+    ##Clean up the local files to save space
+    for path in [audioName, subtitlePath(audioName), scriptPath(theme)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _fromCache(script, audioName):
+    """Copies a cached synthesis and its subtitles next to audioName, False if either is not cached"""
+    key = ttsKey(script, VOICE_ID, TTS_MODEL, TTS_FORMAT)
+    cachedAudio = ttsCache.get(key)
+    cachedSubs = ttsCache.get(subtitlePath(key))
+    if cachedAudio is None or cachedSubs is None:
         return False
-    logging.info("(3/8) -> Pdf successfully extracted")
+    logging.info(f"Using the cached synthesis {key}")
+    shutil.copyfile(cachedAudio, audioName)
+    shutil.copyfile(cachedSubs, subtitlePath(audioName))
+    return True
 
-    ##Generate the prompt for the script
-    theme = todaysTheme["Theme"]
-    activity = todaysTheme["Activity"]
+def _toCache(script, audioName, timeline):
+    ##The subtitles come from the alignment returned with the audio, so no speech recognition is needed later
+    writeSrt(groupCues(timeline.words()), subtitlePath(audioName))
+    key = ttsKey(script, VOICE_ID, TTS_MODEL, TTS_FORMAT)
+    shutil.copyfile(ttsCache.put(key, audioName), audioName)
+    shutil.copyfile(ttsCache.put(subtitlePath(key), subtitlePath(audioName)), subtitlePath(audioName))
 
-    ##This will generate a prompt for chat gpt for if there is or is not a prompt
-    print("GPT prompt sent off")
-    if not activity:
-        prompt = f"Are you able to read the below text and create a 30 second to 1 minute text to speech script about {theme} The video should include an activiy that relates to the topic, preferbably with reference to the text. This request is automated so it would be great if you just return the script. The text is: {chapterText}"
-    else:
-        prompt = f"Are you able to read the below text and create a 30 second to 1 minute text to speech script about {theme}. The video should include an activity for the viewer based around {activity}. This request is automated so it would be great if you just return the script. The text is: {chapterText}"
+def synthesise(script, audioName):
+    """
+    Streams the voiceover for a script into audioName and writes its subtitles beside it from the character timings.
+    A broken stream is retried from the start, and scripts that were already synthesised are copied from the TTS cache
+    """
+    if _fromCache(script, audioName):
+        return audioName
+    def _attempt():
+        timeline = CharacterTimeline()
+        with ttsSlots.slot(): ##The audio streams while the generator is written, so the slot covers both
+            stream = elClient.text_to_speech.stream_with_timestamps(
+                text=script,
+                voice_id=VOICE_ID,
+                model_id=TTS_MODEL,
+                output_format=TTS_FORMAT
+            )
+            writeStream(audioChunks(stream, timeline), audioName)
+        return timeline
+    _toCache(script, audioName, policy("elevenlabs").call(_attempt))
+    return audioName
 
-    ##Load up the chatGPT request
-    maxRetries = 5 ###Set the number of retries for the API requests
-    ##Loop that retries the request to openai api
-    for retry in range(1, maxRetries + 1):
-        backOff = 2**retry
+async def synthesiseAsync(script, audioName):
+    if _fromCache(script, audioName):
+        return audioName
+    async def _attempt():
+        timeline = CharacterTimeline()
+        lock = await asyncio.to_thread(ttsSlots.acquire) ##The slots are shared with every other process
         try:
-            response = openaiClient.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            draftScript = response.choices[0].message.content
-            break ##No need to resume the loop
-        except(RateLimitError, APIError, APIConnectionError, Timeout) as e:
-            logging.warning(
-                f"OpenAI API: {e}. Retrying in {backOff}... "
+            stream = asyncElClient.text_to_speech.stream_with_timestamps(
+                text=script,
+                voice_id=VOICE_ID,
+                model_id=TTS_MODEL,
+                output_format=TTS_FORMAT
             )
-            draftScript = None
-            time.sleep(backOff)
-        except Exception as e:
-            logging.warning(f"Unexpected Error during OpenAI request: {e}, retrying in {backOff}")
-            draftScript = None
+            await writeStreamAsync(audioChunksAsync(stream, timeline), audioName)
+        finally:
+            ttsSlots.release(lock)
+        return timeline
+    _toCache(script, audioName, await policy("elevenlabs").acall(_attempt))
+    return audioName
 
-    ##Stop execution if the script is not generated 
-    if draftScript is None:
-        logging.error("Failed to generate Draft script")
-        return False    
+def uploadAudio(audioName):
+    """Uploads the subtitle sidecar and then the audio, so an audio file in the drive always has its subtitles beside it"""
+    try:
+        driveClient.upload_file(subtitlePath(audioName), AUDIO_DEST_FOLDER, "application/x-subrip")
+    except Exception as e:
+        logging.warning(f"Could not upload the subtitles for {audioName}, editing will transcribe it instead: {e}")
+    return driveClient.upload_file(audioName, AUDIO_DEST_FOLDER, "audio/mpeg")
 
-    logging.info(f"(4/8) -> Draft Script Successfully generated")
-    prompt = f"Could you please clean this script up to be entered directly into Elevenlabs text-to-speech. The result should just have the script with no directions, and please remove any title if there is one. the script is:  {draftScript}"
+def advanceThemes(firstId, lastId, rowCount):
+    """Clears the Used flag of the first theme that was generated and sets it on the theme after the last one"""
+    with WriteSession(contentThemes) as themeWrites:
+        themeWrites.update_cell(firstId, 4, 0)
+        #Check if we are at the end of the list 
+        if lastId >= rowCount + 1:
+            themeWrites.update_cell(2, 4, 1)
+        else:
+            themeWrites.update_cell(lastId + 1, 4, 1)
+    logging.info("Content themes spreadsheet updated")
 
-    ##Ask Chat gpt to edit the script
-    print("GPT Edit prompt sent off")
+def loadPassages(themes):
+    """Index of the chapters the themes are based on, None if none of them could be loaded"""
+    ##The chapter text is cached per page, the pdfs are only downloaded and parsed again when they change on the drive
+    print("extracting the text")
+    chapterIds = list(dict.fromkeys(BOOK_CHAPTERS[theme["Chapter"]] for theme in themes))
+    passages = PassageIndex(chapterIds)
+    if not passages.chapters:
+        logging.error("Could not load the text of any of the book chapters")
+        return None
+    logging.info(f"Indexed {len(passages.passages)} passages from {len(passages.chapters)} of {len(chapterIds)} chapters")
+    return passages
 
-    for retry in range(maxRetries + 1):
-        backOff = 2**retry
-        try:
-            response = openaiClient.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}]
-            )
+def main():
+    print("Loading todays theme")
+    logging.info("\n\n*****************GENERATING CONTENT*********************")
+    todaysTheme, rowCount = getTodaysTheme(contentThemes) ##Return todays theme for content generation
+    logging.info("(1/6) -> Theme successfully generated: {}".format(todaysTheme["Theme"]))
+    theme = todaysTheme["Theme"]
 
-            ##This will be the script for the new content audio
-            script = response.choices[0].message.content
-            break ##No need to re execute the loop
-        except(RateLimitError, APIError, APIConnectionError, Timeout) as e:
-            logging.warning(
-                f"OpenAI API: {e}. Retrying in {backOff}... "
-            )
-            script = None
-            time.sleep(backOff)
+    ##Select the book passages based on the data from todays theme
+    print("Loading the book")
+    passages = loadPassages([todaysTheme])
+    if passages is None:
+        return False ##Log where the error occurred and stop the iteration
+    logging.info("(2/6) -> Book chapters loaded")
+    prompt = themePrompt(todaysTheme, passages)
+    logging.info("(3/6) -> Prompt built from the most relevant passages")
+
+    print("GPT prompt sent off")
+    script = draftScript(theme)
+    if script is None:
+        try:
+            script = generateField(prompt, "script", scriptProblems)
         except Exception as e:
-            logging.warning(f"Unexpected Error during OpenAI request: {e}, retrying in {backOff}")
+            logging.warning(f"OpenAI API: {e}")
             script = None
-    
+        if script is not None:
+            saveDraftScript(theme, script)
+
     ##Stop execution if the script is not generated 
     if script is None:
-        logging.error("Failed to generate Edited Script")
+        logging.error("Failed to generate the script")
         return False    
 
-    logging.info(f"(5/8) -> Script Successfully generated")
+    logging.info(f"(4/6) -> Script Successfully generated")
         
     
     ##Eleven labs audio generation
     ##------------------------------
     print("generating audio with eleven labs")
-
-    for retry in range(maxRetries + 1):
-        backOff = 2**retry
-        try:
-            audio = elClient.text_to_speech.convert(
-                text=script,
-                voice_id="bwBMii6YyaA3YprSpbXH",  # Use Ehssans voice
-                model_id="eleven_multilingual_v2",
-                output_format="mp3_44100_128"
-            )
-            break
-        except Exception as e:
-            logging.warning(f"Error working with Eleven labs: {e}")
-            audio = None
-            time.sleep(backOff)
-    if audio is None:
-        logging.error("Unable to get audio file from Eleven labs, details in logging file")
-        return False
-    
-    logging.info("(6/8) -> Successfully created audio file")
-
     try:
-        # Convert generator into raw bytes
-        audio_bytes = b"".join(audio)
-
-        os.makedirs(AUDIO_DRAFTS_FOLDER, exist_ok=True)
-
-        audioName = AUDIO_DRAFTS_FOLDER + "/" + theme.capitalize().strip() + ".mp3"
-        # Save as MP3 file
-        print("saving audio file")
-        with open(audioName, "wb") as f:
-            f.write(audio_bytes)
+        audioName = synthesise(script, audioPath(theme))
     except Exception as e:
-        logging.error(f"Unable to save audio to local disk: {e}")
+        logging.warning(f"Error working with Eleven labs: {e}")
+        audioName = None
+    if audioName is None:
+        logging.error("Unable to get audio file from Eleven labs, details in logging file")
         return False
     
-    logging.info(f"(7/8) -> Successfully saved the audio to {audioName}")
+    logging.info(f"(5/6) -> Successfully streamed the audio to {audioName}")
 
     
     ##Upload the audio file and update the google sheet
     print("Uploading to the drive")
-    audioLink = driveClient.upload_file(audioName, AUDIO_DEST_FOLDER, "audio/mpeg")
-    logging.info("(8/8) -> Audio uploaded to the drive")
+    audioLink = uploadAudio(audioName)
+    logging.info("(6/6) -> Audio uploaded to the drive")
     
     ##Update the sheets to generate the next round of countent
-
     print("updating the theme")
-    contentThemes.update_cell(todaysTheme["id"], 4, 0)
-    #Check if we are at the end of the list 
-    if todaysTheme["id"] >= rowCount + 1:
-        contentThemes.update_cell(2, 4, 1)
-    else:
-        contentThemes.update_cell(todaysTheme["id"] + 1, 4, 1)
-
-    logging.info("Content themes spreadsheet updated")
+    advanceThemes(todaysTheme["id"], todaysTheme["id"], rowCount)
     
     ##Uploading the script for later use with the date of construction
     today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") ##Get date time from now
     production.append_row([audioLink, script, today])
 
-    ##Clean up the local files to save space
-    os.remove(audioName)
-    os.remove("localStorage/downloads/workingChapter.pdf")
+    clearDraft(theme, audioName)
     return True
 
+def upcomingThemes(count):
+    """Todays theme and the ones after it, wrapping back to the top of the sheet, and the number of theme rows"""
+    todaysTheme, rowCount = getTodaysTheme(contentThemes)
+    rows = getRecords(contentThemes)
+    themes = []
+    for offset in range(min(count, rowCount)):
+        rowId = 2 + (todaysTheme["id"] - 2 + offset) % rowCount ##Sheet rows start at 2 under the header
+        theme = dict(rows[rowId - 2])
+        theme["id"] = rowId
+        themes.append(theme)
+    return themes, rowCount
+
+async def generateThemes(themes, passages):
+    """Scripts and audio for every theme at once, one (script, audio path) or exception per theme"""
+    openaiLimit = asyncio.Semaphore(OPENAI_BATCH_CONCURRENCY)
+
+    async def _generate(theme):
+        script = draftScript(theme["Theme"])
+        if script is None:
+            async with openaiLimit:
+                script = await generateFieldAsync(themePrompt(theme, passages), "script", scriptProblems)
+            if script is None:
+                raise RuntimeError("no usable script came back")
+            saveDraftScript(theme["Theme"], script)
+        logging.info(f"Script generated for {theme['Theme']}")
+        audioName = await synthesiseAsync(script, audioPath(theme["Theme"]))
+        logging.info(f"Audio generated for {theme['Theme']}")
+        return script, audioName
+
+    return await asyncio.gather(*[_generate(theme) for theme in themes], return_exceptions=True)
+
+def batchMain(count):
+    """Generates the next `count` themes concurrently, then uploads them in order up to the first failure and moves the theme cursor past them"""
+    logging.info(f"\n\n*****************GENERATING {count} PIECES OF CONTENT*********************")
+    themes, rowCount = upcomingThemes(count)
+    logging.info(f"Generating themes: {', '.join(theme['Theme'] for theme in themes)}")
+    passages = loadPassages(themes)
+    if passages is None:
+        return False
+
+    print(f"Generating {len(themes)} scripts and audio files")
+    results = asyncio.run(generateThemes(themes, passages))
+
+    print("Uploading to the drive")
+    today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") ##Get date time from now
+    generated = 0
+    ##Uploads stop at the first failure so the cursor can stop on it without the later themes being uploaded twice,
+    ##their draft scripts and cached audio are kept and the rerun reuses them without new OpenAI or ElevenLabs calls
+    with WriteSession(production) as productionWrites:
+        for theme, result in zip(themes, results):
+            if isinstance(result, BaseException):
+                logging.error(f"Could not generate content for {theme['Theme']} (row {theme['id']}): {result}")
+                break
+            script, audioName = result
+            try:
+                audioLink = uploadAudio(audioName)
+            except Exception as e:
+                logging.error(f"Could not upload the audio for {theme['Theme']}, it was kept at {audioName}: {e}")
+                break
+            productionWrites.append_row([audioLink, script, today])
+            clearDraft(theme["Theme"], audioName)
+            generated += 1
+
+    if generated:
+        advanceThemes(themes[0]["id"], themes[generated - 1]["id"], rowCount)
+    if generated < len(themes):
+        logging.warning(f"Theme cursor left on {themes[generated]['Theme']} (row {themes[generated]['id']}), the themes after it keep their drafts for the next run")
+    logging.info(f"Generated {generated} of {len(themes)} themes")
+    return generated == len(themes)
+
 if __name__ == "__main__":
-    contentGenerated = main()
+    parser = argparse.ArgumentParser(description="Generate the script and audio for upcoming content themes")
+    parser.add_argument("--batch", type=int, default=0, metavar="N", help="generate the next N themes concurrently")
+    args = parser.parse_args()
+    contentGenerated = batchMain(args.batch) if args.batch > 1 else main()
     if contentGenerated:
-        logging.info("*******************CONTENT SUCCESSFULLY GENERATED**********************\n\n")
\ No newline at end of file
+        logging.info("*******************CONTENT SUCCESSFULLY GENERATED**********************\n\n")
@@ -1,5 +1,8 @@
-from config.gmailConfig import GmailClient
+from config.gmailConfig import gmailClient
 from config.sheetsConfig import slaList, scripts, production
+from config.sheetSession import WriteSession
+from config.sheetTable import KeyedTable
+from config.sheetSnapshot import getRecords
 from config.driveConfig import driveClient
 import datetime
 from config.jsonFiles import DriveFiles
@@ -7,10 +10,9 @@ from config.jsonFiles import DriveFiles
 UPLOAD_FILES_ID = DriveFiles["Automation"]["2. Content to Send Off"]
 AWAITING_ASSESSMENT_ID = DriveFiles["Automation"]["3. Awaiting Assessment"]
 emails = slaList.col_values(1)[1:]
-gmailClient = GmailClient()
 
 ##Get the script files
-currentScripts = scripts.get_all_records()
+currentScripts = getRecords(scripts)
 scriptIds = []
 for s in currentScripts: ##Only check the scripts with TBA checked
     if s["Publish"] == "TBA":
@@ -19,33 +21,40 @@ for s in currentScripts: ##Only check the scripts with TBA checked
 print("requesting")
 files = driveClient.list_files_in_folder(UPLOAD_FILES_ID)
 noFiles = len(files)
-for file in files:
-    ##Check the script files
-    fileId = file["id"]
-    alreadySent = False
-    for s in scriptIds: ##Continue to the next iteration only if the spreadsheet has been uploaded
-        ##This implies that the team are already aware of the upload.
-        if s == fileId:
-            alreadySent = True
-            break
-    if alreadySent:
-        continue
-    fileName = file["name"]
-    driveLink = driveClient.makePublicLink(fileId)
-    ##Send email to notify the SLA team that the file has been uploaded
+##Continue to the next file only if the spreadsheet has been uploaded
+##This implies that the team are already aware of the upload.
+newFiles = [file for file in files if file["id"] not in scriptIds]
+
+##Make every new file public in one batched request
+publicBatch = driveClient.batch()
+for file in newFiles:
+    publicBatch.makePublic(file["id"])
+driveLinks = publicBatch.flush()
+
+productionTable = KeyedTable(production, keyColumn=1, columns=[2]) ##Only the id and script columns are read
+##The script rows and moves are sent together at the end, also after an error.
+##The moves only run once the rows are written, so a file never leaves the upload folder untracked
+moveBatch = driveClient.batch()
+scriptWrites = WriteSession(scripts)
+try:
+    for file, driveLink in zip(newFiles, driveLinks):
+        ##Check the script files
+        fileId = file["id"]
+        fileName = file["name"]
+        ##Send email to notify the SLA team that the file has been uploaded
     
-    ##Upload Link to the drive
-    ##UPDATE THE SCRIPTS DATABASE
-    todaysDate = datetime.date.today().strftime("%Y-%m-%d")
-    ##Get the script from the production spreadsheet
-    scriptCell = production.find(fileId)
-    scriptText = ""
-    if scriptCell is not None:
-        scriptText = production.row_values(scriptCell.row)[1]
-    scripts.append_row([todaysDate,"Short Video", "TBA",  driveLink, fileId, "", scriptText])
-
-    ##Move the file to await assessment
-    driveClient.move_file(fileId, AWAITING_ASSESSMENT_ID)
+        ##Upload Link to the drive
+        ##UPDATE THE SCRIPTS DATABASE
+        todaysDate = datetime.date.today().strftime("%Y-%m-%d")
+        ##Get the script from the production spreadsheet
+        scriptText = productionTable.value(fileId, 2)
+        scriptWrites.append_row([todaysDate,"Short Video", "TBA",  driveLink, fileId, "", scriptText])
+
+        ##Move the file to await assessment
+        moveBatch.move(fileId, AWAITING_ASSESSMENT_ID)
+finally:
+    scriptWrites.commit()
+    moveBatch.flush()
 
 ##Create the email chain from the list for emails
 
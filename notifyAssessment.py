@@ -1,9 +1,10 @@
 from config.gmailConfig import gmailClient
 from config.sheetsConfig import scripts, slaList
+from config.sheetSnapshot import getRecords
 import datetime
 
 ###Go through the scripts to check the dates of the updates
-records = scripts.get_all_records()
+records = getRecords(scripts)
 listedDates = []
 today = datetime.datetime.now()
 dateToCheck = today - datetime.timedelta(days=3)
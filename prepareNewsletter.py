@@ -1,9 +1,13 @@
 from config.sheetsConfig import published, slaList
 from config.gmailConfig import gmailClient
+from config.sheetSession import WriteSession
+from config.sheetTable import KeyedTable
+from config.sheetSnapshot import getRecords
 import datetime
+import logging
 
 ##Get the list of items that have been published
-allPublished = published.get_all_records()
+allPublished = getRecords(published)
 dateCheck = datetime.date.today() - datetime.timedelta(days=14) ##set the date threshold to be 14 days ago
 sentColumn = 11
 
@@ -48,6 +52,8 @@ if itemsForNewsletter:
                         </tr>
     """
     ##Append content 
+    publishedWrites = WriteSession(published) ##The "Sent" flags are written in one request after the loop
+    publishedTable = KeyedTable(published, keyColumn=1)
     for item in itemsForNewsletter:
         title = item["Title"]
         type = item["Type"]
@@ -70,8 +76,12 @@ if itemsForNewsletter:
                 </tr>
                 """
         ##Update the "Sent to Newsletter" items to Sent
-        itemCell = published.find(item["Id"])
-        published.update_cell(itemCell.row, 11, "Sent")
+        itemRow = publishedTable.row(item["Id"])
+        if itemRow is None:
+            logging.warning(f"{item['Id']} is not in the published spreadsheet")
+            continue
+        publishedWrites.update_cell(itemRow, 11, "Sent")
+    publishedWrites.commit()
 
     html_body += """
                     <tr>
@@ -42,23 +42,26 @@ def mp4converter(input_path):
 
 
 def batch_convert(videosToConvert):
-    for video in videosToConvert:
-        videoId = video["id"]
-        videoName = video["name"]
-        localPath = driveClient.download_file(videoId, videoName)
-        # Determines conversion target (full path to the video file to be converted)
-        if localPath.lower().endswith(( ##Only deal with video files and ignore all others
-                ".mkv", ".avi", ".mov", ".flv", ".webm", ".wmv", ".m4v", ".mp4"
-            )):
-            outputFile = mp4converter(localPath)
-            ##Upload the mp4 file to the drive
-            driveClient.upload_file(outputFile, DRIVE_DEST, "video/mp4")
-            os.remove(outputFile)
+    with driveClient.batch() as driveBatch: ##The originals are deleted together once converted
+        for video in videosToConvert:
+            videoId = video["id"]
+            videoName = video["name"]
+            localPath = driveClient.download_file(videoId, videoName)
+            if localPath is None: ##Keep the original, the partial download resumes next run
+                continue
+            # Determines conversion target (full path to the video file to be converted)
+            if localPath.lower().endswith(( ##Only deal with video files and ignore all others
+                    ".mkv", ".avi", ".mov", ".flv", ".webm", ".wmv", ".m4v", ".mp4"
+                )):
+                outputFile = mp4converter(localPath)
+                ##Upload the mp4 file to the drive
+                driveClient.upload_file(outputFile, DRIVE_DEST, "video/mp4")
+                os.remove(outputFile)
 
-        ##Remove the original file in the drive 
-        driveClient.delete_file(videoId)
-        ##Remove the local files
-        os.remove(localPath)
+            ##Remove the original file in the drive 
+            driveBatch.delete(videoId)
+            ##Remove the local files
+            os.remove(localPath)
         
 videosToConvert = driveClient.list_files_in_folder(DRIVE_SOURCE) ##Get files from the videos that we want to upload
 batch_convert(videosToConvert)
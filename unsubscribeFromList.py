@@ -1,20 +1,38 @@
 from config.sheetsConfig import unsub, unsubArchive, contacts
+from config.sheetSession import deleteRows
+from config.sheetSnapshot import getRecords
 import datetime
+import logging
+
+def normaliseEmail(email):
+    return str(email).lower().strip()
 
 ##Get all of the entries in the unsubscribe logs
-unsubLogs = unsub.get_all_records()
+unsubLogs = getRecords(unsub)
 today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") ##Get date time from now
-rowNumber = 2
-##Go through the requests to remove the emails
-for request in unsubLogs:
-    email = request["Email Address"].lower().strip()
-    emailToRemove = contacts.find(email)
-    if emailToRemove is not None:
-        contacts.delete_rows(emailToRemove.row)
-    unsub.delete_rows(rowNumber)
-    unsubArchive.append_row([today, email])
-    rowNumber += 1
-    
-    
-    
-    
\ No newline at end of file
+toRemove = {normaliseEmail(request["Email Address"]) for request in unsubLogs}
+toRemove.discard("") ##A blank response must not match contacts with blank cells
+
+if unsubLogs:
+    ##Read the contact list once and find the unsubscribed rows in memory
+    contactRows = contacts.get_all_values()
+    header = contactRows[0] if contactRows else []
+    emailColumns = [i for i, name in enumerate(header) if "email" in name.lower()]
+
+    def isUnsubscribed(row):
+        ##Without an email header every cell is checked, like contacts.find did
+        cells = [row[i] for i in emailColumns if i < len(row)] if emailColumns else row
+        return any(normaliseEmail(cell) in toRemove for cell in cells if str(cell).strip())
+
+    ##Sheet row numbers of the contacts to remove, the header is row 1
+    toDelete = [i for i, row in enumerate(contactRows[1:], start=2) if isUnsubscribed(row)]
+
+    ##Archive first so a failed delete never loses a request
+    unsubArchive.append_rows([[today, normaliseEmail(request["Email Address"])] for request in unsubLogs])
+
+    ##Only the matching rows are deleted, every other cell is left as it was
+    deleteRows(contacts, toDelete)
+
+    ##Every processed response is removed with one delete
+    deleteRows(unsub, range(2, len(unsubLogs) + 2))
+    logging.info(f"Processed {len(unsubLogs)} unsubscribe requests, {len(toDelete)} contacts removed")
@@ -2,7 +2,10 @@ from config.youtubeConfig import youtubeUploader
 from config.driveConfig import driveClient
 from config.jsonFiles import DriveFiles
 from config.sheetsConfig import published
+from config.sheetSession import WriteSession
+from config.sheetTable import KeyedTable
 import os
+import logging
 import datetime
 
 ##Upload files from the drive in the 'Publish to youtube' folder
@@ -21,27 +24,40 @@ descColumn = 10
 ##Get todays date
 today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") ##Get date time from now
 
+publishedTable = KeyedTable(published, idColumn, columns=[descColumn]) ##Only the id and description columns are read
+
 for file in filesToPublish:
     id = file["id"]
     name = file["name"]
     ytTitle = os.path.splitext(name)[0]
     
+    sheetRow = publishedTable.row(id) ##Find the row in the 'published' spreadsheet
+    if sheetRow is None:
+        logging.warning(f"{id} is not in the published spreadsheet")
+        continue
+    description = publishedTable.value(id, descColumn)
+
     ##Download the file to upload to yt
     localName = driveClient.download_file(id, ytTitle)
+    if localName is None:
+        continue
     
-    sheetCell = published.find(id, in_column=idColumn) ##Find the cell in the 'published' spreadsheet
-    description = published.row_values(sheetCell.row)[descColumn - 1]
     ytLink = youtubeUploader.upload_video(localName, ytTitle, description=description) ##Upload to youtube
+    if ytLink is None:
+        ##Leave the file in place so the next run resumes the saved upload session
+        continue
     print(f"{name} Uploaded to youtube as {ytLink}")
-    
-    published.update_cell(sheetCell.row, ytUploadColumn, today) ##Update the upload date
-    published.update_cell(sheetCell.row, ytLinkColumn, ytLink) ##Add the YT link
-    published.update_cell(sheetCell.row, statusColumn, "Uploaded") ##Set the status to Uploaded
-    published.update_cell(sheetCell.row, titleColumn,  ytTitle)
-    print("Spreadsheet updated")
 
-    ##Move the file into the ARCHIVE folder in the drive
-    driveClient.move_file(id, ARCHIVE_FOLDER)
-    
+    ##A finished upload cannot be repeated without a duplicate video, so its row and archive move are sent straight away
+    ##The sheet writes go in one request and are sent before the move, even if the other fails
+    with driveClient.batch() as driveBatch, WriteSession(published) as publishedWrites:
+        publishedWrites.update_cell(sheetRow, ytUploadColumn, today) ##Update the upload date
+        publishedWrites.update_cell(sheetRow, ytLinkColumn, ytLink) ##Add the YT link
+        publishedWrites.update_cell(sheetRow, statusColumn, "Uploaded") ##Set the status to Uploaded
+        publishedWrites.update_cell(sheetRow, titleColumn,  ytTitle)
+
+        ##Move the file into the ARCHIVE folder in the drive
+        driveBatch.move(id, ARCHIVE_FOLDER)
+    print("Spreadsheet updated")
 
     os.remove(localName) ##Remove the file in local storage